@@ -1,7 +1,8 @@
 from babel.ubergraph import UberGraph
 from src.LabeledID import LabeledID
 from src.util import Text
-from babel.babel_utils import write_compendium,glom,get_prefixes
+from babel.babel_utils import write_compendium,glom,get_prefixes,dump_quarantine,max_clique_size,write_metrics
+from babel.concordance import Concordance
 
 #The BTO and BAMs identifiers promote over-glommed nodes
 def build_sets(iri, ignore_list = ['PMID','BTO','BAMS']):
@@ -47,12 +48,14 @@ def load_anatomy():
     # Sooo, we gotta clean that up.
     #relabel_entities(anatomy_sets)
     #relabel_entities(cellular_component_sets)
-    dicts = {}
+    dicts = Concordance(max_clique_size=max_clique_size('anatomy'))
     print('put it all together')
     glom(dicts, anatomy_sets, unique_prefixes=['UBERON','GO'])
     glom(dicts, cellular_component_sets, unique_prefixes=['UBERON','GO'])
     labels.update(labels_b)
-    anat_sets, cell_sets, cc_sets = create_typed_sets(set([frozenset(x) for x in dicts.values()]))
+    dump_quarantine(dicts,'anatomy_quarantine.txt')
+    write_metrics(dicts,'anatomy_glom_metrics.jsonl')
+    anat_sets, cell_sets, cc_sets = create_typed_sets(dicts.cliques())
     write_compendium(anat_sets,'anatomy.txt','biolink:AnatomicalEntity',labels)
     write_compendium(cell_sets,'cell.txt','biolink:Cell',labels)
     write_compendium(cc_sets,'cellular_component.txt','biolink:CellularComponent',labels)
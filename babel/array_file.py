@@ -0,0 +1,29 @@
+from array import array
+import json
+
+MAGIC = b'BABEL-ARRAYS 1\n'
+
+def write_arrays(fname, meta, arrays):
+    """Write a dict of named arrays to fname, along with a json-able dict of anything else.  The file is a
+    magic line, one line of json saying what's in it, and then the raw bytes of each array in order, so
+    reading it back is just a read per array."""
+    header = {'meta': meta, 'arrays': [[name, arr.typecode, len(arr)] for name, arr in arrays.items()]}
+    with open(fname, 'wb') as outf:
+        outf.write(MAGIC)
+        outf.write(json.dumps(header).encode())
+        outf.write(b'\n')
+        for arr in arrays.values():
+            arr.tofile(outf)
+
+def read_arrays(fname):
+    """Returns (meta, arrays) as written by write_arrays"""
+    with open(fname, 'rb') as inf:
+        if inf.readline() != MAGIC:
+            raise ValueError(f'{fname} is not an array file')
+        header = json.loads(inf.readline())
+        arrays = {}
+        for name, typecode, length in header['arrays']:
+            arr = array(typecode)
+            arr.fromfile(inf, length)
+            arrays[name] = arr
+    return header['meta'], arrays
@@ -8,11 +8,17 @@ import requests
 import os
 import urllib
 import jsonlines
-from babel.node import NodeFactory
+from babel.node import NodeEncoder, NodeFactory
+from babel.block_file import BlockWriter, EXTENSIONS, LineWriter, ShardedWriter, compress_block, partition, shard_names
+from babel.id_index import IdIndexWriter, id_index_name
+from babel.sqlite_compendium import load_sqlite
+from babel.concordance import Concordance
 from src.util import Text
 from src.LabeledID import LabeledID
 from json import load
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import islice
+from multiprocessing import Pool
 import sqlite3
 
 def make_local_name(fname):
@@ -92,6 +98,20 @@ def dump_dicts(dicts,fname):
         for k in dicts:
             outf.write(f'{k}\t{dicts[k]}\n')
 
+def dump_quarantine(concord,fname):
+    """Write out the groups that glom left out for making a clique too big, one per line: the size the
+    clique would have been, then the group"""
+    if len(concord.quarantine) == 0:
+        return
+    print(f'{len(concord.quarantine)} groups would have made cliques bigger than {concord.max_clique_size}')
+    with open(make_local_name(fname),'w') as outf:
+        for group, size in concord.quarantine:
+            outf.write('\t'.join([str(size)] + group) + '\n')
+
+def max_clique_size(name):
+    """The configured ceiling on clique size for one compendium build, or None"""
+    return get_config().get('max_clique_size',{}).get(name)
+
 def dump_sets(sets,fname):
     config = get_config()
     oname = os.path.join(os.path.dirname(__file__),config['download_directory'], fname)
@@ -180,14 +200,133 @@ def pull_via_urllib(url: str, in_file_name: str, decompress = True):
     # return the filename to the caller
     return out_file_name
 
-def write_compendium(synonym_list,ofname,node_type,labels={}):
+def write_metrics(concord,ofname,mode='w'):
+    """Write out the glom metrics a Concordance has collected as json lines next to the compendia, and
+    forget them.  Use mode='a' to add to the file from a build that writes as it goes."""
+    cdir = os.path.dirname(os.path.abspath(__file__))
+    with jsonlines.open(os.path.join(cdir,'compendia',ofname),mode) as outf:
+        for record in concord.metrics:
+            outf.write(record)
+    concord.metrics = []
+
+def write_compendium(synonym_list,ofname,node_type,labels={},processes=None,batch_size=10000,compression=None,block_records=10000,id_index=None,sqlite=None,shards=None):
+    """Write a node for each set of synonyms in synonym_list to compendia/ofname, one json object per line.
+    With more than one process (by default, the write_processes config value), the nodes are built and
+    encoded on a process pool, batch_size sets at a time.  Only a couple of batches per process are ever in
+    flight, and they're written back in order, so the file has the same lines in the same order as the
+    one-process version.
+    With compression ('gzip' or 'zstd', by default the compendium_compression config value), the lines are
+    written as independently compressed blocks of block_records nodes, with a block index next to the file
+    (see block_file.BlockWriter), and ofname gets .gz or .zst added to it.  On a process pool, the workers
+    compress too, so each batch is cut into its own blocks and its last block can come up short.  The blocks
+    are only the one-process version's when batch_size is a multiple of block_records and every set in
+    synonym_list makes a node.
+    With id_index (by default, the compendium_id_index config value), every equivalent identifier is also
+    indexed to its record in a sorted sidecar file, ofname.ids, for id_index.CompendiumIndex to look up.
+    With sqlite (by default, the compendium_sqlite config value), the finished compendium is also loaded into
+    a SQLite database, ofname.sqlite (see sqlite_compendium.load_sqlite).
+    With shards above one (by default, the compendium_shards config value), the nodes are split between that
+    many files by a hash of their preferred identifier (see block_file.ShardedWriter), chemicals.000-of-004.txt
+    and so on, with a manifest of the shards, and each shard gets its own sidecars."""
     cdir = os.path.dirname(os.path.abspath(__file__))
-    node_factory = NodeFactory()
-    with jsonlines.open(os.path.join(cdir,'compendia',ofname),'w') as outf:
-        for slist in synonym_list:
-            node = node_factory.create_node(input_identifiers=slist, node_type=node_type,labels = labels)
-            if node is not None:
-                outf.write( node )
+    config = get_config()
+    if processes is None:
+        processes = config.get('write_processes',1)
+    if compression is None:
+        compression = config.get('compendium_compression')
+    if id_index is None:
+        id_index = config.get('compendium_id_index',False)
+    if sqlite is None:
+        sqlite = config.get('compendium_sqlite',False)
+    if shards is None:
+        shards = config.get('compendium_shards',1)
+    fname = os.path.join(cdir,'compendia',ofname)
+    if compression is not None:
+        fname += EXTENSIONS[compression]
+    node_factory = NodeFactory(biolink_version=get_config().get('biolink_model_version'))
+    if processes > 1:
+        write_compendium_parallel(synonym_list,fname,node_type,labels,node_factory,processes,batch_size,compression,block_records,id_index,shards)
+    else:
+        encode = NodeEncoder(node_factory.get_plan(node_type).types).encode
+        with _open_compendium(fname,compression,block_records,id_index,shards) as outf:
+            for identifiers, line in _encoded_nodes(synonym_list,node_type,labels,node_factory,encode):
+                outf.write(identifiers,line)
+    if sqlite:
+        for shard_fname in (shard_names(fname,shards) if shards > 1 else [fname]):
+            load_sqlite(shard_fname)
+
+def _open_compendium(fname,compression,block_records,id_index,shards=1):
+    if shards > 1:
+        return ShardedWriter(fname,[_open_compendium(shard_fname,compression,block_records,id_index) for shard_fname in shard_names(fname,shards)])
+    index_writer = IdIndexWriter(id_index_name(fname)) if id_index else None
+    if compression is None:
+        return LineWriter(fname,index_writer)
+    return BlockWriter(fname,compression,block_records,index_writer)
+
+def _encoded_nodes(synonym_list,node_type,labels,node_factory,encode):
+    """(equivalent identifiers, utf-8 line) for each node"""
+    for slist in synonym_list:
+        node = node_factory.create_node(input_identifiers=slist, node_type=node_type,labels = labels)
+        if node is not None:
+            yield [ident['identifier'] for ident in node['equivalent_identifiers']], encode(node).encode('utf-8')
+
+#Per-process state for the write_compendium workers
+_writer = {}
+
+def _init_writer(node_type,labels,node_factory,compression,block_records,shards):
+    _writer['node_factory'] = node_factory
+    _writer['node_type'] = node_type
+    _writer['labels'] = labels
+    _writer['encode'] = NodeEncoder(node_factory.get_plan(node_type).types).encode
+    _writer['compression'] = compression
+    _writer['block_records'] = block_records
+    _writer['shards'] = shards
+
+def _write_batch(batch):
+    nodes = list(_encoded_nodes(batch,_writer['node_type'],_writer['labels'],_writer['node_factory'],_writer['encode']))
+    if _writer['shards'] > 1:
+        parts = partition(nodes,_writer['shards'])
+        if _writer['compression'] is None:
+            return parts
+        #ShardedWriter.write_block takes a block for every shard, so the shards that run out first get empty
+        #blocks, which the writers skip
+        blocks = [_compress_blocks(part) for part in parts]
+        empty = compress_block([],_writer['compression'])
+        return [[shard_blocks[n] if n < len(shard_blocks) else empty for shard_blocks in blocks]
+                for n in range(max([len(shard_blocks) for shard_blocks in blocks]))]
+    if _writer['compression'] is None:
+        return nodes
+    return _compress_blocks(nodes)
+
+def _compress_blocks(nodes):
+    """The workers do the compressing too, so a batch comes back as its own blocks of block_records nodes"""
+    block_records = _writer['block_records']
+    return [compress_block(nodes[start:start+block_records],_writer['compression']) for start in range(0,len(nodes),block_records)]
+
+def write_compendium_parallel(synonym_list,fname,node_type,labels,node_factory,processes,batch_size,compression=None,block_records=10000,id_index=False,shards=1):
+    max_in_flight = 2 * processes
+    synonym_list = iter(synonym_list)
+    #Look the type up here, so that the workers all start with it instead of each asking the biolink service.
+    #The labels and factory go to the workers once, when they start, instead of with every batch.
+    node_factory.get_plan(node_type)
+    outf = _open_compendium(fname,compression,block_records,id_index,shards)
+    if compression is None:
+        put = outf.write_records
+    else:
+        def put(blocks):
+            for block in blocks:
+                outf.write_block(block)
+    with outf, Pool(processes,initializer=_init_writer,initargs=(node_type,labels,node_factory,compression,block_records,shards)) as pool:
+        in_flight = deque()
+        while True:
+            batch = list(islice(synonym_list,batch_size))
+            if len(batch) == 0:
+                break
+            in_flight.append(pool.apply_async(_write_batch,(batch,)))
+            if len(in_flight) >= max_in_flight:
+                put(in_flight.popleft().get())
+        while len(in_flight) > 0:
+            put(in_flight.popleft().get())
 
 def glom(conc_set, newgroups, unique_prefixes=['INCHIKEY'],pref='HP',close={}):
     """We want to construct sets containing equivalent identifiers.
@@ -195,7 +334,11 @@ def glom(conc_set, newgroups, unique_prefixes=['INCHIKEY'],pref='HP',close={}):
     the keys are all of the elements in the set.   For each element in a set, there is a key
     in the dictionary that points to the set.
     newgroups is an iterable that of new equivalence groups (expressed as sets,tuples,or lists)
-    with which we want to update conc_set."""
+    with which we want to update conc_set.
+    conc_set can also be a Concordance, which gives the same answer without copying sets around."""
+    if isinstance(conc_set, Concordance):
+        conc_set.glom(newgroups, unique_prefixes=unique_prefixes, pref=pref, close=close)
+        return
     n = 0
     bad = 0
     shit_prefixes=set(['KEGG.COMPOUND','PUBCHEM','GTOPDB'])
@@ -16,10 +16,11 @@ def merge(key=None, *iterables):
     # http://groups.google.com/group/comp.lang.python/msg/484f01f1ea3c832d
 
     if key is None:
-        keyed_iterables = iterables
-    else:
-        keyed_iterables = [(Keyed(key(obj), obj) for obj in iterable)
-                            for iterable in iterables]
+        for element in heapq.merge(*iterables):
+            yield element
+        return
+    keyed_iterables = [(Keyed(key(obj), obj) for obj in iterable)
+                        for iterable in iterables]
     for element in heapq.merge(*keyed_iterables):
         yield element.obj
 
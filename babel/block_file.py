@@ -0,0 +1,320 @@
+import gzip
+import hashlib
+import json
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+def compress(data, compression):
+    if compression == 'gzip':
+        #mtime=0 so the same records always make the same bytes
+        return gzip.compress(data, mtime=0)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd blocks need the zstandard package')
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError(f'Unknown compression {compression}, expected one of {list(EXTENSIONS)}')
+
+def decompress(data, compression):
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd blocks need the zstandard package')
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f'Unknown compression {compression}, expected one of {list(EXTENSIONS)}')
+
+def compress_block(records, compression):
+    """records is a list of (identifiers, line).  Returns the block as (data, number of records, first
+    identifier, last identifier, identifiers of each record)."""
+    if len(records) == 0:
+        return b'', 0, None, None, []
+    identifiers = [ids for ids, _ in records]
+    return compress(b''.join([line for _, line in records]), compression), len(records), identifiers[0][0], identifiers[-1][0], identifiers
+
+def index_name(fname):
+    return f'{fname}.index.json'
+
+def remove_files(*fnames):
+    """Remove whichever of fnames exist"""
+    for fname in fnames:
+        if os.path.exists(fname):
+            os.remove(fname)
+
+class LineWriter:
+    """Writes lines to fname, uncompressed.  Takes the same calls as BlockWriter, so that writers don't have
+    to care which one they have.  With an id_index (an id_index.IdIndexWriter), every identifier of a line
+    is indexed to the line's byte offset.  The file is written under a temporary name and renamed into place
+    at close, so anything that has the old one open (or mmapped) keeps seeing it whole.  close is finish,
+    which completes every file under its temporary name, and then publish, which renames the sidecars into
+    place and the file itself last, so that a new file never goes with old sidecars.  Leaving a with block
+    on an exception calls abort instead, which throws the temporary files away."""
+    def __init__(self, fname, id_index=None):
+        self.fname = fname
+        self.tmpname = f'{fname}.tmp'
+        self.id_index = id_index
+        self.offset = 0
+        self.outf = open(self.tmpname, 'wb')
+
+    def write(self, identifiers, line):
+        if self.id_index is not None:
+            self.id_index.add(identifiers, self.offset)
+        self.outf.write(line)
+        self.offset += len(line)
+
+    def write_records(self, records):
+        """Write a list of (identifiers, line)"""
+        if self.id_index is None:
+            self.outf.write(b''.join([line for _, line in records]))
+            self.offset += sum([len(line) for _, line in records])
+            return
+        for identifiers, line in records:
+            self.write(identifiers, line)
+
+    def finish(self):
+        self.outf.close()
+        if self.id_index is not None:
+            self.id_index.finish()
+
+    def publish(self):
+        if self.id_index is not None:
+            self.id_index.publish()
+        os.replace(self.tmpname, self.fname)
+
+    def close(self):
+        self.finish()
+        self.publish()
+
+    def abort(self):
+        self.outf.close()
+        remove_files(self.tmpname)
+        if self.id_index is not None:
+            self.id_index.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class BlockWriter:
+    """Writes lines to fname as a run of independently compressed blocks of block_records lines each, and
+    an index of the blocks to fname.index.json.  The blocks are whole gzip members (or zstd frames), so the
+    file as a whole still decompresses with zcat, but a reader that has the index can pull out just the
+    block it wants.  Each line goes in with the identifiers it's known by (for compendia, the node's
+    equivalent identifiers, preferred first), and the index keeps the offset, length, record count, and
+    first and last preferred identifier of every block.  With an id_index, every identifier of a line is
+    indexed to the byte offset of its block and its line number in the block.  Like LineWriter, the file
+    only replaces an old one at close, after its sidecars, and is thrown away if a with block fails."""
+    def __init__(self, fname, compression='gzip', block_records=10000, id_index=None):
+        #check the compression before making a file
+        compress(b'', compression)
+        self.fname = fname
+        self.compression = compression
+        self.block_records = block_records
+        self.id_index = id_index
+        self.records = []
+        self.blocks = []
+        self.offset = 0
+        self.tmpname = f'{fname}.tmp'
+        self.outf = open(self.tmpname, 'wb')
+
+    def write(self, identifiers, line):
+        self.records.append((identifiers, line))
+        if len(self.records) >= self.block_records:
+            self.flush()
+
+    def flush(self):
+        self.write_block(compress_block(self.records, self.compression))
+        self.records = []
+
+    def write_block(self, block):
+        """Write a block made by compress_block"""
+        data, records, first, last, identifiers = block
+        if records == 0:
+            return
+        if self.id_index is not None:
+            for line, ids in enumerate(identifiers):
+                self.id_index.add(ids, self.offset, line)
+        self.blocks.append([self.offset, len(data), records, first, last])
+        self.outf.write(data)
+        self.offset += len(data)
+
+    def finish(self):
+        self.flush()
+        self.outf.close()
+        with open(f'{index_name(self.fname)}.tmp', 'w') as outf:
+            json.dump({'compression': self.compression, 'block_records': self.block_records, 'blocks': self.blocks}, outf)
+        if self.id_index is not None:
+            self.id_index.finish()
+
+    def publish(self):
+        if self.id_index is not None:
+            self.id_index.publish()
+        os.replace(f'{index_name(self.fname)}.tmp', index_name(self.fname))
+        os.replace(self.tmpname, self.fname)
+
+    def close(self):
+        self.finish()
+        self.publish()
+
+    def abort(self):
+        self.outf.close()
+        remove_files(self.tmpname, f'{index_name(self.fname)}.tmp')
+        if self.id_index is not None:
+            self.id_index.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def shard_of(identifier, shards):
+    """The shard of a record with this preferred identifier.  crc32, so it's the same from run to run."""
+    return zlib.crc32(identifier.encode('utf-8')) % shards
+
+def partition(records, shards):
+    """Split a list of (identifiers, line) into a list for each shard"""
+    parts = [[] for _ in range(shards)]
+    for record in records:
+        parts[shard_of(record[0][0], shards)].append(record)
+    return parts
+
+def shard_names(fname, shards):
+    """The files of a compendium written as shards: chemicals.txt.gz becomes chemicals.000-of-004.txt.gz ..."""
+    directory, name = os.path.split(fname)
+    suffix = ''
+    for extension in EXTENSIONS.values():
+        if name.endswith(extension):
+            name, suffix = name[:-len(extension)], extension
+    if name.endswith('.txt'):
+        name, suffix = name[:-len('.txt')], f'.txt{suffix}'
+    return [os.path.join(directory, f'{name}.{shard:03d}-of-{shards:03d}{suffix}') for shard in range(shards)]
+
+def manifest_name(fname):
+    return f'{fname}.manifest.json'
+
+class ShardedWriter:
+    """Splits lines between writers (LineWriters or BlockWriters, one per file of shard_names(fname)) by a
+    hash of their preferred identifier, and when it's closed, writes fname.manifest.json, with the record
+    count, size and sha256 of each shard.  write_records and write_block take a list with one entry per
+    shard, as made by partition, and hand each entry to its shard's writer.  Every shard is finished before
+    any is published, and the manifest goes last."""
+    def __init__(self, fname, writers):
+        self.fname = fname
+        self.writers = writers
+        self.records = [0] * len(writers)
+
+    def write(self, identifiers, line):
+        shard = shard_of(identifiers[0], len(self.writers))
+        self.records[shard] += 1
+        self.writers[shard].write(identifiers, line)
+
+    def write_records(self, parts):
+        for shard, records in enumerate(parts):
+            self.records[shard] += len(records)
+            self.writers[shard].write_records(records)
+
+    def write_block(self, parts):
+        for shard, block in enumerate(parts):
+            self.records[shard] += block[1]
+            self.writers[shard].write_block(block)
+
+    def close(self):
+        for writer in self.writers:
+            writer.finish()
+        files = []
+        for shard, writer in enumerate(self.writers):
+            sha = hashlib.sha256()
+            with open(writer.tmpname, 'rb') as inf:
+                for chunk in iter(lambda: inf.read(1 << 20), b''):
+                    sha.update(chunk)
+            files.append({'file': os.path.basename(writer.fname), 'records': self.records[shard],
+                          'bytes': os.path.getsize(writer.tmpname), 'sha256': sha.hexdigest()})
+        manifest = {'shards': len(self.writers), 'partition': 'crc32(utf-8 preferred identifier) % shards', 'files': files}
+        with open(f'{manifest_name(self.fname)}.tmp', 'w') as outf:
+            json.dump(manifest, outf, indent=2)
+        for writer in self.writers:
+            writer.publish()
+        os.replace(f'{manifest_name(self.fname)}.tmp', manifest_name(self.fname))
+
+    def abort(self):
+        for writer in self.writers:
+            writer.abort()
+        remove_files(f'{manifest_name(self.fname)}.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def read_manifest(fname):
+    """The manifest of a sharded compendium, with the full path of each shard added as 'path'"""
+    with open(manifest_name(fname), 'r') as inf:
+        manifest = json.load(inf)
+    for entry in manifest['files']:
+        entry['path'] = os.path.join(os.path.dirname(fname), entry['file'])
+    return manifest
+
+def read_index(fname):
+    """The index of a file written by BlockWriter: a dict with compression, block_records, and blocks, a
+    list of [offset, length, records, first identifier, last identifier]"""
+    with open(index_name(fname), 'r') as inf:
+        return json.load(inf)
+
+def read_block(fname, index, block):
+    """The lines (as bytes, newlines included) of the block'th block of fname"""
+    offset, length, _, _, _ = index['blocks'][block]
+    with open(fname, 'rb') as inf:
+        inf.seek(offset)
+        data = inf.read(length)
+    return decompress(data, index['compression']).splitlines(keepends=True)
+
+def read_block_at(inf, offset, compression):
+    """The lines of the block starting at offset of the open file inf, without needing the block index"""
+    if compression == 'gzip':
+        decompressor = zlib.decompressobj(wbits=31)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd blocks need the zstandard package')
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        raise ValueError(f'Unknown compression {compression}, expected one of {list(EXTENSIONS)}')
+    inf.seek(offset)
+    data = []
+    #a block ends where its gzip member (or zstd frame) does
+    while not decompressor.eof:
+        chunk = inf.read(65536)
+        if len(chunk) == 0:
+            break
+        data.append(decompressor.decompress(chunk))
+    return b''.join(data).splitlines(keepends=True)
+
+def iter_lines(fname):
+    """Every line of fname, plain or block compressed (by its extension), in order"""
+    if not any([fname.endswith(extension) for extension in EXTENSIONS.values()]):
+        with open(fname, 'rb') as inf:
+            for line in inf:
+                yield line
+        return
+    index = read_index(fname)
+    for block in range(len(index['blocks'])):
+        for line in read_block(fname, index, block):
+            yield line
@@ -0,0 +1,239 @@
+from array import array
+
+import numpy as np
+
+from babel.array_file import read_arrays, write_arrays
+from babel.bulk_glom import bulk_glom_ids, connected_components
+from babel.concordance import CloseIndex, GlomMetrics
+
+class BuildLog:
+    """Remembers every group that was glommed into a Concordance, so that a build can later be updated when
+    only one of its sources changes.
+
+    Each glom (or bulk_glom) call is one source, named after the build stage that made it and how many
+    gloms that stage had done so far (chebi.0, chebi.1, ...).  A source keeps its parameters and its groups,
+    as interned ids in one flat array plus offsets.  Attach a log to a Concordance (concord.log = BuildLog())
+    and glom and bulk_glom fill it in.
+
+    In capture mode the gloms don't touch the Concordance at all, they just collect the groups, which is
+    how update_sources finds out what a re-run stage would have done."""
+    def __init__(self):
+        self.stage = None
+        self.sources = []
+        self.params = {}
+        self.groups = {}
+        self.capturing = False
+        self.captured = []
+        self._calls = {}
+        self._current = None
+
+    def set_stage(self, stage):
+        self.stage = stage
+        self._calls[stage] = 0
+
+    def begin(self, unique_prefixes, close, bulk=False):
+        """Start a new source for a glom call"""
+        name = f'{self.stage}.{self._calls.get(self.stage, 0)}'
+        self._calls[self.stage] = self._calls.get(self.stage, 0) + 1
+        params = {'unique_prefixes': list(unique_prefixes), 'bulk': bulk,
+                  'close': {cpref: {k: sorted(v) for k, v in closedict.items()} for cpref, closedict in close.items()}}
+        self._current = (array('i'), array('Q', [0]))
+        if self.capturing:
+            self.captured.append((name, params, self._current))
+        else:
+            self.sources.append(name)
+            self.params[name] = params
+            self.groups[name] = self._current
+
+    def add(self, group_ids):
+        if len(group_ids) == 0:
+            return
+        ids, offsets = self._current
+        ids.extend(group_ids)
+        offsets.append(len(ids))
+
+    def add_pairs(self, left, right):
+        ids, offsets = self._current
+        pairs = np.empty(2 * len(left), dtype=np.int32)
+        pairs[0::2] = left
+        pairs[1::2] = right
+        ids.frombytes(pairs.tobytes())
+        start = offsets[-1]
+        offsets.frombytes(np.arange(start + 2, start + 2 * len(left) + 1, 2, dtype=np.uint64).tobytes())
+
+    def start_capture(self, stage):
+        self.set_stage(stage)
+        self.capturing = True
+        self.captured = []
+
+    def stop_capture(self):
+        self.capturing = False
+        captured = self.captured
+        self.captured = []
+        return captured
+
+    def stage_sources(self, stage):
+        return [name for name in self.sources if name.rsplit('.', 1)[0] == stage]
+
+    def save(self, fname, stage):
+        """Write the sources from one stage to fname"""
+        names = self.stage_sources(stage)
+        arrays = {}
+        for name in names:
+            arrays[f'{name}.ids'], arrays[f'{name}.offsets'] = self.groups[name]
+        write_arrays(fname, {'sources': [[name, self.params[name]] for name in names]}, arrays)
+
+    def load(self, fname):
+        """Append the sources in fname, as written by save"""
+        meta, arrays = read_arrays(fname)
+        for name, params in meta['sources']:
+            self.sources.append(name)
+            self.params[name] = params
+            self.groups[name] = (arrays[f'{name}.ids'], arrays[f'{name}.offsets'])
+
+def group_tuples(ids, offsets):
+    return [tuple(ids[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+
+def record_cliques(concord, log, target=None):
+    """Log the current cliques of concord as one source, for stages like UniChem that hand back a fully
+    formed Concordance instead of glomming into one.  Replaying them is an unconditional merge.  If target
+    is given, the log belongs to target, and the members are interned there."""
+    log.begin([], {})
+    for root in concord.key_ids():
+        if concord.parent[root] == root:
+            members = list(concord.member_ids(root))
+            if target is not None:
+                members = [target.intern(concord.curies.curie(member)) for member in members]
+            log.add(members)
+
+def capture_stage(stage, name, concord, labels):
+    """Run stage(concord, labels) with concord's log in capture mode, and return the sources it would have
+    glommed.  Stages that read the concordance (like the MeSH/ChEBI filter) see it as it is now, rather than
+    as it was when the stage first ran."""
+    log = concord.log
+    log.start_capture(name)
+    try:
+        result = stage(concord, labels)
+        if result is not concord:
+            record_cliques(result, log, target=concord)
+    finally:
+        captured = log.stop_capture()
+    return captured
+
+def update_sources(concord, log, captured):
+    """Swap the captured sources (from a stage re-run in capture mode) into the log, and rebuild just the
+    part of concord that they could have changed.
+
+    glom depends on the order of the groups, and a group that's added or dropped can change whether later
+    groups get rejected, so it isn't enough to redo the cliques the changed groups touch.  Instead we take
+    every identifier in an added or removed group, and grow that out to everything connected to it by any
+    group from any source (rejected or not).  No group outside that closure shares an identifier with one
+    inside it, so resetting the closure and replaying its groups, in the original source order, gives
+    exactly what a full rebuild would.  Returns the number of identifiers that were rebuilt."""
+    affected = set()
+    stages = set()
+    for name, params, (ids, offsets) in captured:
+        stages.add(name.rsplit('.', 1)[0])
+        affected.update(_changed_ids(log, name, params, ids, offsets))
+    #A stage that now does fewer gloms than before loses the extra sources entirely
+    captured_names = set([name for name, _, _ in captured])
+    for stage in stages:
+        for name in log.stage_sources(stage):
+            if name not in captured_names:
+                affected.update(log.groups[name][0])
+    _replace_sources(log, captured, stages)
+    if len(affected) == 0:
+        return 0
+    metrics = GlomMetrics(concord, 'update', None, [])
+    closure = _closure(concord, log, affected)
+    _reset(concord, closure)
+    replayed = 0
+    in_closure = np.zeros(len(concord.parent), dtype=bool)
+    in_closure[closure] = True
+    for name in log.sources:
+        ids, offsets = log.groups[name]
+        if len(ids) == 0:
+            continue
+        ids = np.frombuffer(ids, dtype=np.int32).astype(np.int64)
+        offsets = np.frombuffer(offsets, dtype=np.uint64).astype(np.int64)
+        #groups are whole, so checking the first member is enough
+        keep = np.flatnonzero(in_closure[ids[offsets[:-1]]])
+        if len(keep) == 0:
+            continue
+        params = log.params[name]
+        replayed += len(keep)
+        if params['bulk']:
+            bulk_glom_ids(concord, ids[offsets[keep]], ids[offsets[keep] + 1], params['unique_prefixes'], params['close'])
+            continue
+        index = CloseIndex(concord, params['close']) if params['close'] else None
+        for g in keep.tolist():
+            group = ids[offsets[g]:offsets[g + 1]].tolist()
+            concord.glom_ids(group, params['unique_prefixes'], index)
+    metrics.finish(replayed)
+    return len(closure)
+
+def _changed_ids(log, name, params, ids, offsets):
+    if name not in log.groups:
+        return ids
+    if log.params[name] != params:
+        return list(ids) + list(log.groups[name][0])
+    old = group_tuples(*log.groups[name])
+    new = group_tuples(ids, offsets)
+    if old == new:
+        return []
+    changed = set()
+    for group in set(old).symmetric_difference(new):
+        changed.update(group)
+    return changed
+
+def _replace_sources(log, captured, stages):
+    """Put the captured sources where their stage's sources used to be in the log"""
+    position = None
+    for stage in stages:
+        for name in log.stage_sources(stage):
+            if position is None:
+                position = log.sources.index(name)
+            log.sources.remove(name)
+            del log.params[name]
+            del log.groups[name]
+    if position is None:
+        position = len(log.sources)
+    for name, params, groups in captured:
+        log.sources.insert(position, name)
+        position += 1
+        log.params[name] = params
+        log.groups[name] = groups
+
+def _closure(concord, log, affected):
+    """Everything connected to affected through the logged groups"""
+    n = len(concord.parent)
+    firsts = []
+    others = []
+    for name in log.sources:
+        ids, offsets = log.groups[name]
+        if len(ids) == 0:
+            continue
+        ids = np.frombuffer(ids, dtype=np.int32).astype(np.int64)
+        offsets = np.frombuffer(offsets, dtype=np.uint64).astype(np.int64)
+        #connect every member of a group to the group's first member
+        lengths = np.diff(offsets)
+        firsts.append(np.repeat(ids[offsets[:-1]], lengths))
+        others.append(ids)
+    labels = connected_components(n, np.concatenate(firsts), np.concatenate(others))
+    affected = np.fromiter(affected, dtype=np.int64)
+    return np.flatnonzero(np.isin(labels, labels[affected]))
+
+def _reset(concord, closure):
+    """Take the ids in closure back out of concord.  closure has to be made of whole cliques."""
+    dropped = 0
+    for ident in closure.tolist():
+        if concord.parent[ident] >= 0:
+            dropped += 1
+        concord.parent[ident] = -1
+        concord.next[ident] = -1
+        concord.size[ident] = 0
+        concord.seen[ident] = 0
+        concord.repeated[ident] = 0
+        concord.wide_summaries.pop(ident, None)
+    concord.count -= dropped
+    concord.largest = int(np.frombuffer(concord.size, dtype=np.int32).max())
@@ -0,0 +1,213 @@
+from multiprocessing import Pool
+
+import numpy as np
+
+from babel.babel_utils import get_config
+from babel.concordance import CloseIndex, FORBIDDEN_PREFIXES, GlomMetrics, LOW_64
+
+def intern_pairs(concord, pairs):
+    """Intern a list of (curie, curie) pairs into concord's CurieTable, returning two int64 id columns"""
+    def ids():
+        for a, b in pairs:
+            yield concord.intern(a)
+            yield concord.intern(b)
+    both = np.fromiter(ids(), dtype=np.int64)
+    return both[0::2], both[1::2]
+
+def connected_components(n, u, v):
+    """Label the connected components of the graph with nodes 0..n-1 and edges (u[i],v[i]).
+    Every node ends up labelled with the smallest node in its component.  This alternates hooking (each edge
+    pulls the larger of its two labels down to the smaller one) with pointer jumping, until no edge spans
+    two labels, so the whole thing is a handful of numpy passes over the edge list."""
+    labels = np.arange(n, dtype=np.int64)
+    while True:
+        lu = labels[u]
+        lv = labels[v]
+        spanning = lu != lv
+        if not spanning.any():
+            return labels
+        lu = lu[spanning]
+        lv = lv[spanning]
+        np.minimum.at(labels, np.maximum(lu, lv), np.minimum(lu, lv))
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+def spanning_forest(u, v):
+    """Reduce the edges (u[i],v[i]) to one edge from each node to the smallest node in its component.
+    Returns (nodes, labels), which has the same connectivity as the input, but no duplicate edges."""
+    nodes, inverse = np.unique(np.concatenate([u, v]), return_inverse=True)
+    labels = connected_components(len(nodes), inverse[:len(u)], inverse[len(u):])
+    return nodes, nodes[labels]
+
+def _shard_forest(shard):
+    return spanning_forest(*shard)
+
+def parallel_forest(left, right, processes, shard_size=1000000):
+    """spanning_forest, with the pairs cut into shards that are reduced on a pool of processes.  Stitching
+    the shard forests back together is left to whoever finds the components of the result."""
+    shards = [(left[i:i + shard_size], right[i:i + shard_size]) for i in range(0, len(left), shard_size)]
+    with Pool(processes) as pool:
+        forests = pool.map(_shard_forest, shards)
+    return np.concatenate([f[0] for f in forests]), np.concatenate([f[1] for f in forests])
+
+def bulk_glom(concord, pairs, unique_prefixes=['INCHIKEY'], pref='HP', close={}, processes=None):
+    """glom a big list of (curie, curie) pairs into a Concordance.  See bulk_glom_ids.
+    With processes > 1 (by default the glom_processes config value), the connectivity of the pairs is worked
+    out on a process pool first; the result is exactly the same."""
+    left, right = intern_pairs(concord, pairs)
+    if concord.log is not None:
+        concord.log.begin(unique_prefixes, close, bulk=True)
+        concord.log.add_pairs(left, right)
+        if concord.log.capturing:
+            return
+    metrics = GlomMetrics(concord, 'bulk_glom', pref, unique_prefixes)
+    if processes is None:
+        processes = get_config().get('glom_processes', 1)
+    links = None
+    if processes > 1 and len(left) > 0:
+        links = parallel_forest(left, right, processes)
+    bulk_glom_ids(concord, left, right, unique_prefixes=unique_prefixes, close=close, links=links)
+    metrics.finish(len(left))
+
+def bulk_glom_ids(concord, left, right, unique_prefixes=['INCHIKEY'], close={}, links=None):
+    """glom pairs of interned ids (two numpy columns) into concord, with the same result as calling glom on the
+    pairs one at a time, in order.
+
+    The pairs, plus the cliques they already touch, are broken into components in one vectorized pass.
+    Pairs in different components touch disjoint cliques, so they can't affect each other.  If the whole of a
+    component (all of its pairs and all of the cliques they touch) passes the unique_prefixes check, then so
+    would every intermediate set that glom would have built along the way, so the component can be merged
+    in one go.  Components that fail the check, that would be bigger than concord.max_clique_size, or that
+    contain an identifier with a close-match prefix are handed back to glom one pair at a time, in their
+    original order, which gives the order-dependent answer exactly.
+
+    links, if given, is another pair of id columns with the same connectivity as left and right (like the
+    shard forests from parallel_forest), and is used instead of them to find the components."""
+    left = np.asarray(left, dtype=np.int64)
+    right = np.asarray(right, dtype=np.int64)
+    if len(left) == 0:
+        return
+    curies = concord.curies
+    n = len(concord.parent)
+    parent = np.array(concord.parent, dtype=np.int64)
+    present = parent >= 0
+    #Find every root at once
+    roots = np.where(present, parent, np.arange(n, dtype=np.int64))
+    while True:
+        jumped = roots[roots]
+        if np.array_equal(jumped, roots):
+            break
+        roots = jumped
+    #The nodes of the component graph are the existing cliques (by root) and the new ids
+    if links is None:
+        links = (left, right)
+    link_left, link_right = links
+    nodes, inverse = np.unique(np.concatenate([roots[link_left], roots[link_right]]), return_inverse=True)
+    nnodes = len(nodes)
+    comp = connected_components(nnodes, inverse[:len(link_left)], inverse[len(link_left):])
+    u = np.searchsorted(nodes, roots[left])
+    #Everything that would end up in each component: the members of touched cliques, plus new ids
+    member_ids = np.flatnonzero(present & np.isin(roots, nodes))
+    new_nodes = np.flatnonzero(~present[nodes])
+    all_members = np.concatenate([member_ids, nodes[new_nodes]])
+    all_comps = np.concatenate([comp[np.searchsorted(nodes, roots[member_ids])], comp[new_nodes]])
+    member_codes = np.array(curies.prefix_of, dtype=np.int64)[all_members]
+    def prefix_mask(test):
+        return np.array([p is not None and test(p) for p in curies.prefixes], dtype=bool)
+    forbidden = prefix_mask(lambda p: p in FORBIDDEN_PREFIXES)[member_codes]
+    if forbidden.any():
+        bad_prefix = curies.prefix(int(all_members[np.argmax(forbidden)]))
+        print(bad_prefix)
+        raise ValueError(f'Forbidden prefix {bad_prefix}')
+    rejected = np.zeros(nnodes, dtype=bool)
+    for up in unique_prefixes:
+        matching = prefix_mask(lambda p: p.startswith(up))[member_codes]
+        rejected |= np.bincount(all_comps[matching], minlength=nnodes) > 1
+    for cpref in close:
+        matching = prefix_mask(lambda p: p.startswith(cpref))[member_codes]
+        rejected |= np.bincount(all_comps[matching], minlength=nnodes) > 0
+    if concord.max_clique_size is not None:
+        #glom decides which pairs to leave out of an oversized component, so it gets all of them
+        rejected |= np.bincount(all_comps, minlength=nnodes) > concord.max_clique_size
+    #Fully compress the existing trees while we're here, then merge the good components
+    merge = np.flatnonzero(~rejected[comp])
+    new_roots, merged_comps = _merge_components(concord, np.where(present, roots, -1), nodes[merge], comp[merge])
+    keep = ~rejected[all_comps]
+    _set_summaries(concord, new_roots, merged_comps, all_comps[keep], member_codes[keep], nnodes)
+    #And do the rest the slow way
+    slow = np.flatnonzero(rejected[comp[u]])
+    index = CloseIndex(concord, close) if close and len(slow) > 0 else None
+    for a, b in zip(left[slow].tolist(), right[slow].tolist()):
+        concord.glom_ids(list(dict.fromkeys([a, b])), unique_prefixes, index)
+
+def _merge_components(concord, compressed, nodes, comps):
+    """Merge each group of nodes (roots or new ids) that share a comps label into one clique.
+    The biggest clique in each group becomes the root, and the member rings are spliced together by
+    rotating the next pointers of the roots within each group."""
+    parent = np.frombuffer(concord.parent, dtype=np.int32)
+    nxt = np.frombuffer(concord.next, dtype=np.int32)
+    size = np.frombuffer(concord.size, dtype=np.int32)
+    try:
+        parent[:] = compressed
+        new = nodes[size[nodes] == 0]
+        parent[new] = new
+        nxt[new] = new
+        size[new] = 1
+        concord.count += len(new)
+        sizes = size[nodes]
+        order = np.lexsort((nodes, -sizes, comps))
+        nodes = nodes[order]
+        comps = comps[order]
+        sizes = sizes[order]
+        if len(nodes) == 0:
+            return nodes, comps
+        starts = np.flatnonzero(np.concatenate([[True], comps[1:] != comps[:-1]]))
+        lengths = np.diff(np.concatenate([starts, [len(nodes)]]))
+        new_roots = np.repeat(nodes[starts], lengths)
+        parent[nodes] = new_roots
+        size[nodes] = 0
+        size[nodes[starts]] = np.add.reduceat(sizes, starts)
+        concord.largest = max(concord.largest, int(size[nodes[starts]].max()))
+        rotate = np.arange(1, len(nodes) + 1)
+        rotate[starts + lengths - 1] = starts
+        nxt[nodes] = nxt[nodes][rotate]
+        return nodes[starts], comps[starts]
+    finally:
+        #numpy views keep the arrays from being resized, so let go of them
+        del parent, nxt, size
+
+def _set_summaries(concord, new_roots, merged_comps, member_comps, member_codes, ncomps):
+    """Rebuild the prefix summaries of freshly merged cliques from the prefix codes of all their members"""
+    if len(new_roots) == 0:
+        return
+    ncodes = len(concord.curies.prefixes)
+    keys, counts = np.unique(member_comps * ncodes + member_codes, return_counts=True)
+    comps = keys // ncodes
+    codes = keys % ncodes
+    low = codes < 64
+    seen = np.zeros(ncomps, dtype=np.uint64)
+    repeated = np.zeros(ncomps, dtype=np.uint64)
+    bits = np.left_shift(np.uint64(1), codes[low].astype(np.uint64))
+    np.bitwise_or.at(seen, comps[low], bits)
+    np.bitwise_or.at(repeated, comps[low][counts[low] > 1], bits[counts[low] > 1])
+    seen_view = np.frombuffer(concord.seen, dtype=np.uint64)
+    repeated_view = np.frombuffer(concord.repeated, dtype=np.uint64)
+    try:
+        seen_view[new_roots] = seen[merged_comps]
+        repeated_view[new_roots] = repeated[merged_comps]
+    finally:
+        del seen_view, repeated_view
+    #Prefix codes past 64 are rare enough to do in python
+    wide = {}
+    for comp, code, count in zip(comps[~low].tolist(), codes[~low].tolist(), counts[~low].tolist()):
+        wide_seen, wide_repeated = wide.get(comp, (0, 0))
+        bit = 1 << (code - 64)
+        wide[comp] = (wide_seen | bit, wide_repeated | (bit if count > 1 else 0))
+    if wide or concord.wide_summaries:
+        for root, comp in zip(new_roots.tolist(), merged_comps.tolist()):
+            low_seen, low_repeated = concord.summary(root)
+            wide_seen, wide_repeated = wide.get(comp, (0, 0))
+            concord.set_summary(root, (low_seen & LOW_64) | (wide_seen << 64), (low_repeated & LOW_64) | (wide_repeated << 64))
@@ -0,0 +1,86 @@
+import json
+import os
+
+from babel.babel_utils import make_local_name
+from babel.build_log import BuildLog
+from babel.concordance import Concordance
+
+class Checkpoints:
+    """Saves the concordance and labels after each named stage of a build, so that a build that dies late
+    can be picked up again without redoing the early stages.
+
+    stages is the list of stage names, in the order the build runs them.  Checkpoints for a build named
+    'chemicals' go in babel_downloads/checkpoints/chemicals/<stage>.conc (and <stage>.labels.json).  If the
+    concordance has a BuildLog, the sources each stage added to it go in <stage>.log, and loading a stage
+    puts back the log of everything up to and including it."""
+    def __init__(self, name, stages, directory=None):
+        self.stages = list(stages)
+        if directory is None:
+            directory = make_local_name(os.path.join('checkpoints', name))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _paths(self, stage):
+        self._index(stage)
+        return os.path.join(self.directory, f'{stage}.conc'), os.path.join(self.directory, f'{stage}.labels.json')
+
+    def save(self, stage, concord, labels):
+        conc_name, label_name = self._paths(stage)
+        #write then rename, so that dying mid-write doesn't leave a checkpoint that looks good
+        concord.save(f'{conc_name}.tmp')
+        with open(f'{label_name}.tmp', 'w') as outf:
+            json.dump(labels, outf)
+        os.replace(f'{conc_name}.tmp', conc_name)
+        os.replace(f'{label_name}.tmp', label_name)
+        if concord.log is not None:
+            self.save_log(stage, concord.log)
+
+    def save_log(self, stage, log):
+        log_name = self._log_path(stage)
+        log.save(f'{log_name}.tmp', stage)
+        os.replace(f'{log_name}.tmp', log_name)
+
+    def discard(self, stage):
+        """Remove the concordance and labels of a stage, leaving its log.  For checkpoints that no longer
+        agree with the logs after an incremental update."""
+        for fname in self._paths(stage):
+            if os.path.exists(fname):
+                os.remove(fname)
+
+    def _log_path(self, stage):
+        self._index(stage)
+        return os.path.join(self.directory, f'{stage}.log')
+
+    def load(self, stage):
+        """Returns (concord, labels) as they were at the end of stage"""
+        conc_name, label_name = self._paths(stage)
+        concord = Concordance.load(conc_name)
+        with open(label_name, 'r') as inf:
+            labels = json.load(inf)
+        log_names = [self._log_path(s) for s in self.stages[:self._index(stage) + 1]]
+        if all([os.path.exists(log_name) for log_name in log_names]):
+            concord.log = BuildLog()
+            for log_name in log_names:
+                concord.log.load(log_name)
+        return concord, labels
+
+    def resume(self, resume_from=None):
+        """Returns (concord, labels) to start a build from stage resume_from: the state at the end of the
+        stage before it.  Starting from the top (resume_from None or the first stage) gives (None, {})."""
+        if resume_from is None:
+            return None, {}
+        i = self._index(resume_from)
+        if i == 0:
+            return None, {}
+        return self.load(self.stages[i - 1])
+
+    def should_run(self, stage, resume_from=None):
+        """True if stage is resume_from or comes after it"""
+        if resume_from is None:
+            return True
+        return self._index(stage) >= self._index(resume_from)
+
+    def _index(self, stage):
+        if stage not in self.stages:
+            raise ValueError(f'Unknown stage {stage}, expected one of {self.stages}')
+        return self.stages.index(stage)
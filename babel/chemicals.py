@@ -1,4 +1,5 @@
 from functools import partial
+import argparse
 import logging
 import os
 import pickle
@@ -7,12 +8,17 @@ import asyncio
 import gzip
 from collections import defaultdict
 
-from babel.unichem.unichem import load_unichem
+from babel.unichem.unichem import load_unichem, iter_unichem_pairs
 from src.util import LoggingUtil, Text
 from src.LabeledID import LabeledID
 
 from babel.chemical_mesh_unii import refresh_mesh_pubchem
-from babel.babel_utils import glom, pull_via_ftp, write_compendium, make_local_name
+from babel.babel_utils import glom, pull_via_ftp, write_compendium, make_local_name, dump_quarantine, max_clique_size, write_metrics
+from babel.build_log import BuildLog, capture_stage, record_cliques, update_sources
+from babel.bulk_glom import bulk_glom
+from babel.checkpoints import Checkpoints
+from babel.concordance import Concordance
+from babel.external_components import ExternalComponents
 from babel.chemistry_pulls import pull_chebi, pull_uniprot, pull_iuphar, pull_kegg_sequences, pull_kegg_compounds
 from babel.ubergraph import UberGraph
 
@@ -134,41 +140,126 @@ def filter_mesh_chebi(mesh_chebi,concord):
 # 10. Drop PRO only sequences.
 #
 # It would be good to completely redo this so that it was make-like.
-def load_chemicals(refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,refresh_uniprot=False,refresh_pubchem=False,refresh_chembl=False):
+def chemical_stages(refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,refresh_uniprot=False,refresh_chembl=False):
+    return [('unichem', partial(stage_unichem, refresh_mesh=refresh_mesh, refresh_unichem=refresh_unichem)),
+            ('mesh_unii', stage_mesh_unii),
+            ('mesh_pubchem', stage_mesh_pubchem),
+            ('mesh_chebi', stage_mesh_chebi),
+            ('chemical_mesh', stage_chemical_mesh),
+            ('chebi', stage_chebi),
+            ('kegg', partial(stage_kegg, refresh_kegg=refresh_kegg)),
+            ('sequences', partial(stage_sequences, refresh_uniprot=refresh_uniprot)),
+            ('labels', partial(stage_labels, refresh_chembl=refresh_chembl))]
+
+def load_chemicals(refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,refresh_uniprot=False,refresh_pubchem=False,refresh_chembl=False,resume_from=None):
+    """Run the chemical stages in order, checkpointing the concordance and labels after each one.
+    resume_from names a stage to start at, picking up the checkpoint of the stage before it.
+    Every glom is logged too, so that update_chemicals can redo just one stage later."""
+    stages = chemical_stages(refresh_mesh,refresh_unichem,refresh_kegg,refresh_uniprot,refresh_chembl)
+    checkpoints = Checkpoints('chemicals', [name for name, _ in stages])
     #Keep labels separate
-    labels = {}
-    # DO MESH/CHEBI, but don't combine any chebi's into a set with it
-    print('MESH/CHEBI')
-    mesh_chebi = pull_mesh_chebi()
+    concord, labels = checkpoints.resume(resume_from)
+    #A build from the top starts the metrics over, and one that resumes adds to what the earlier stages wrote
+    metrics_mode = 'w' if concord is None else 'a'
+    for name, stage in stages:
+        if not checkpoints.should_run(name, resume_from):
+            continue
+        if concord is not None:
+            concord.max_clique_size = max_clique_size('chemicals')
+            concord.stage = name
+            if concord.log is not None:
+                concord.log.set_stage(name)
+        result = stage(concord, labels)
+        if result is not concord:
+            #UniChem hands back a brand new concordance
+            result.log = BuildLog()
+            result.log.set_stage(name)
+            record_cliques(result, result.log)
+        concord = result
+        dump_quarantine(concord, f'chemicals_{name}_quarantine.txt')
+        concord.quarantine = []
+        write_metrics(concord, 'chemicals_glom_metrics.jsonl', mode=metrics_mode)
+        metrics_mode = 'a'
+        checkpoints.save(name, concord, labels)
+    print('dumping')
+    #Dump
+    #tout = set([frozenset(x) for x in concord.values()][:10000])
+    #write_compendium(tout,'chemconc.txt','chemical_substance',labels=labels)
+    #exit()
+    write_compendium(concord.cliques(),'chemconc.txt','biolink:ChemicalSubstance',labels=labels)
+    print('done')
+
+def update_chemicals(refreshed,refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,refresh_uniprot=False,refresh_chembl=False):
+    """Incremental rebuild, for when only some sources have changed (a new ChEBI release, say).  The stages
+    named in refreshed are re-run in capture mode against the last full build, and only the parts of the
+    concordance connected to groups that changed are rebuilt; see build_log.update_sources."""
+    stages = chemical_stages(refresh_mesh,refresh_unichem,refresh_kegg,refresh_uniprot,refresh_chembl)
+    names = [name for name, _ in stages]
+    #Check the names before doing any work, rather than failing once the concordance has been rebuilt
+    unknown = [name for name in refreshed if name not in names]
+    if len(refreshed) == 0 or len(unknown) > 0:
+        raise ValueError(f'Unknown stages {unknown} to update, expected some of {names}')
+    checkpoints = Checkpoints('chemicals', names)
+    concord, labels = checkpoints.load(names[-1])
+    if concord.log is None:
+        raise ValueError('The last chemicals checkpoint has no build log; do a full load_chemicals first')
+    captured = []
+    for name, stage in stages:
+        if name in refreshed:
+            print(f'capturing {name}')
+            captured.extend(capture_stage(stage, name, concord, labels))
+    concord.max_clique_size = max_clique_size('chemicals')
+    rebuilt = update_sources(concord, concord.log, captured)
+    dump_quarantine(concord, 'chemicals_update_quarantine.txt')
+    write_metrics(concord, 'chemicals_glom_metrics.jsonl', mode='a')
+    print(f'rebuilt {rebuilt} identifiers')
+    first = min([names.index(name) for name in refreshed])
+    for name in names[first:-1]:
+        #These no longer match the logs, so resuming from them would be wrong
+        checkpoints.discard(name)
+    for name in refreshed:
+        checkpoints.save_log(name, concord.log)
+    checkpoints.save(names[-1], concord, labels)
+    write_compendium(concord.cliques(),'chemconc.txt','biolink:ChemicalSubstance',labels=labels)
+    print('done')
+
+def stage_unichem(concord, labels, refresh_mesh=False, refresh_unichem=False):
     # Build if need be
     if refresh_mesh:
         refresh_mesh_pubchem()
     #Get all the simple stuff
     # 1. Handle all the stuff that has an InchiKey using unichem
-    # 2. Mesh is all "no structure".  We try to use a variety of sources to hook mesh id's to anything else
     print('UNICHEM')
     #refresh
-    concord = load_unichem(refresh=refresh_unichem)
+    return load_unichem(refresh=refresh_unichem)
     #don't refresh
     #concord = load_unichem()
+
+def stage_mesh_unii(concord, labels):
     # 2. Mesh is all "no structure".  We try to use a variety of sources to hook mesh id's to anything else
     #DO MESH/UNII
     print('MESH/UNII')
     mesh_unii_file = make_local_name( 'mesh_to_unii.txt')
     mesh_unii_pairs = load_pairs(mesh_unii_file, 'UNII')
-    glom(concord, mesh_unii_pairs,pref='MESH')
+    bulk_glom(concord, mesh_unii_pairs,pref='MESH')
     print('write-mesh-unii was fine')
     check_multiple_ids(concord)
+    return concord
+
+def stage_mesh_pubchem(concord, labels):
     # DO MESH/PUBCHEM
     print('MESH/PUBCHEM')
     mesh_pc_file = make_local_name('mesh_to_pubchem.txt')
     mesh_pc_pairs = load_pairs(mesh_pc_file, 'PUBCHEM.COMPOUND')
-    glom(concord, mesh_pc_pairs,pref='MESH')
+    bulk_glom(concord, mesh_pc_pairs,pref='MESH')
     print('write-mesh-pubchem')
     check_multiple_ids(concord)
+    return concord
+
+def stage_mesh_chebi(concord, labels):
     # DO MESH/CHEBI, but don't combine any chebi's into a set with it
-    #print('MESH/CHEBI')
-    #mesh_chebi = pull_mesh_chebi()
+    print('MESH/CHEBI')
+    mesh_chebi = pull_mesh_chebi()
     #Merging CHEBIS can be ok because of primary/secondary chebis.  Really we 
     # don't want to merge INCHIs
     #MESH/CHEBI is a real mess though.  wikidata has no principled way to connect identifiers.  It's just whatever
@@ -177,9 +268,12 @@ def load_chemicals(refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,r
     mesh_chebi_filter = filter_mesh_chebi(mesh_chebi,concord)
     print(f"Started with {len(mesh_chebi)} m/c pairs")
     print(f"filtered to {len(mesh_chebi_filter)} m/c pairs")
-    glom(concord, mesh_chebi_filter,pref='MESH')
+    bulk_glom(concord, mesh_chebi_filter,pref='MESH')
     print('write-mesh-chebi')
     check_multiple_ids(concord)
+    return concord
+
+def stage_chemical_mesh(concord, labels):
     #Now pull all the chemical meshes.
     cmesh = []
     with open( make_local_name('chemical_mesh.txt'),'r') as inf:
@@ -190,24 +284,26 @@ def load_chemicals(refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,r
             cmesh.append ( (meshid,) )
             labels[meshid] = label
     glom(concord, cmesh)
-    #print('write-mesh')
     #this one is ok 3/8/2020
-    #write_compendium(set([ frozenset(x) for x in concord.values() ]),'chemconc_mesh.txt','chemical_substance',labels=labels)
     check_multiple_ids(concord)
+    return concord
+
+def stage_chebi(concord, labels):
     # 3. Pull from chebi the sdf and db files, use them to link to things (KEGG) in the no inchi/no smiles cases
     print('chebi')
     pubchem_chebi_pairs, kegg_chebi_pairs, chebi_unmapped = pull_chebi()
     all_chebis,chebi_labels = get_all_chebis()
     labels.update(chebi_labels)
-    glom(concord, pubchem_chebi_pairs,pref= 'CHEBI')
-    glom(concord, kegg_chebi_pairs,pref='CHEBI')
+    bulk_glom(concord, pubchem_chebi_pairs,pref= 'CHEBI')
+    bulk_glom(concord, kegg_chebi_pairs,pref='CHEBI')
     glom(concord, chebi_unmapped, pref='CHEBI')
     glom(concord, all_chebis, pref = 'CHEBI')
     print('write-chebi')
     #good march 8#
-    #write_compendium(set([ frozenset(x) for x in concord.values() ]),'chemconc_chebi.txt','chemical_substance',labels=labels)
-    #exit()
     check_multiple_ids(concord)
+    return concord
+
+def stage_kegg(concord, labels, refresh_kegg=False):
     # 3a. pull in all KEGG labels and compounds.  This is mostly to pick up keggs that don't map to anything else
     print('kegg')
     kname = make_local_name('kegg.pickle')
@@ -226,7 +322,9 @@ def load_chemicals(refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,r
     labels.update(kegg_labels)
     #OK TO HERE
     check_multiple_ids(concord)
-    #write_compendium(set([ frozenset(x) for x in concord.values() ]),'chemconc_kegg.txt','chemical_substance',labels=labels)
+    return concord
+
+def stage_sequences(concord, labels, refresh_uniprot=False):
     # 4. Go to KEGG, and get sequences for peptides.
     sequence_concord = pull_kegg_sequences()
     # 5. Pull UniProt (swissprot) XML.
@@ -243,18 +341,15 @@ def load_chemicals(refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,r
     for s,v in sequence_to_iuphar.items():
         sequence_concord[s].update(v)
     glom(concord,iuphar_glom,pref='gtpo')
-    #write_compendium(set([ frozenset(x) for x in concord.values() ]),'chemconc_iuphar.txt','chemical_substance',labels=labels)
     check_multiple_ids(concord)
     #  8. Use wikidata to get links between CHEBI and UniProt_PRO
     #These 2 lines are if we want back uniprots
     #unichebi = pull_uniprot_chebi() 
     #glom(concord, unichebi)
-    #write_compendium(set([ frozenset(x) for x in concord.values() ]),'chemconc_unicheb.txt','chemical_substance',labels=labels)
     check_multiple_ids(concord)
     #  9. glom across sequence and chemical stuff
     new_groups = sequence_concord.values()
     glom(concord,new_groups,unique_prefixes=['gtpo','INCHI'])
-    #write_compendium(set([ frozenset(x) for x in concord.values() ]),'chemconc_newgroups.txt','chemical_substance',labels=labels)
     check_multiple_ids(concord)
     # 10. Drop PRO only sequences.
     # Something odd going on, remove for now.
@@ -268,21 +363,32 @@ def load_chemicals(refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,r
     #for eids in to_remove:
     #    concord.remove(eids)
     #And we're back
+    return concord
+
+def stage_labels(concord, labels, refresh_chembl=False):
     #Add labels to CHEBIs, CHEMBLs, MESHes
     print('LABEL')
     #label_chebis(concord)
     labels.update(label_chembls(concord, refresh_chembl = refresh_chembl ))
     #label_meshes(concord)
 #    label_pubchem(concord, refresh_pubchem = refresh_pubchem)
-    print('dumping')
-    #Dump
-    #tout = set([frozenset(x) for x in concord.values()][:10000])
-    #write_compendium(tout,'chemconc.txt','chemical_substance',labels=labels)
-    #exit()
-    write_compendium(set([ frozenset(x) for x in concord.values() ]),'chemconc.txt','biolink:ChemicalSubstance',labels=labels)
-    print('done')
+    return concord
+
+def build_external_chemicals(memory_limit=None):
+    """Build raw chemical equivalence sets from UniChem and the MeSH pair files without holding them in
+    memory, for machines that can't fit the full concordance.  This is plain connectivity, so none of the
+    unique_prefixes rules that load_chemicals applies are enforced here."""
+    builder = ExternalComponents(memory_limit=memory_limit)
+    builder.add_pairs(iter_unichem_pairs(make_local_name('UC_XREF.filtered.txt'), make_local_name('UC_STRUCT.sorted.txt')))
+    builder.add_pairs(iter_pairs(make_local_name('mesh_to_unii.txt'), 'UNII'))
+    builder.add_pairs(iter_pairs(make_local_name('mesh_to_pubchem.txt'), 'PUBCHEM.COMPOUND'))
+    write_compendium(builder.cliques(),'chemconc_external.txt','biolink:ChemicalSubstance')
 
 def check_multiple_ids(g):
+    #A Concordance interns each identifier once and never holds LabeledIDs, so there's nothing to find, and
+    # walking its keys would turn every id back into a string
+    if isinstance(g, Concordance):
+        return
     used = set()
     olks = {}
     for k in g.keys():
@@ -466,7 +572,10 @@ def remove_ticks(s):
 
 
 def load_pairs(fname, prefix):
-    pairs = []
+    return list(iter_pairs(fname, prefix))
+
+def iter_pairs(fname, prefix):
+    """Stream the (MESH, prefix) pairs out of one of the mesh_to_X files"""
     with open(fname, 'r') as inf:
         for line in inf:
             x = line.strip().split('\t')
@@ -478,8 +587,7 @@ def load_pairs(fname, prefix):
                 pre_ids = [x[1]]
             ids = [f'{prefix}:{pid}' for pid in pre_ids]
             for identifier in ids:
-                pairs.append((mesh, identifier))
-    return pairs
+                yield (mesh, identifier)
 
 
 def uni_glom(unichem_data, prefix1, prefix2, chemdict):
@@ -492,7 +600,10 @@ def uni_glom(unichem_data, prefix1, prefix2, chemdict):
         if p[0].startswith("'") or p[1].startswith("'"):
             print('UNI_GLOM {prefix1} {prefix2} {p}')
     curiepairs = [(f'{prefix1}:{p[0]}', f'{prefix2}:{p[1]}') for p in pairs]
-    glom(chemdict, curiepairs)
+    if isinstance(chemdict, Concordance):
+        bulk_glom(chemdict, curiepairs)
+    else:
+        glom(chemdict, curiepairs)
 
 
 
@@ -680,6 +791,13 @@ def kegg_stand():
 # Main - Stand alone entry point for testing
 #######
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the chemical compendium')
+    parser.add_argument('--resume-from', default=None, help='Stage to restart at, using the checkpoint from the stage before it')
+    parser.add_argument('--update', nargs='+', default=None, help='Stages whose sources changed; incrementally update the last build')
+    args = parser.parse_args()
+    if args.update is not None:
+        update_chemicals(args.update,refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,refresh_uniprot=False,refresh_chembl=True)
+        exit()
     #load_chemicals(refresh_mesh=False,refresh_uniprot=True,refresh_pubchem=True,refresh_chembl=True)
-    load_chemicals(refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,refresh_uniprot=False,refresh_pubchem=True,refresh_chembl=True)
+    load_chemicals(refresh_mesh=False,refresh_unichem=False,refresh_kegg=False,refresh_uniprot=False,refresh_pubchem=True,refresh_chembl=True,resume_from=args.resume_from)
     #load_unichem(working_dir='.',xref_file='UC_XREF.txt.gz',struct_file='UC_STRUCTURE.txt')
@@ -0,0 +1,463 @@
+from array import array
+from collections import defaultdict
+import time
+
+from babel.array_file import read_arrays, write_arrays
+from babel.curie_table import CurieTable
+
+#These prefixes should never make it into a clique; if they do, something upstream is producing garbage
+FORBIDDEN_PREFIXES = frozenset(['KEGG.COMPOUND','PUBCHEM','GTOPDB'])
+
+LOW_64 = (1 << 64) - 1
+
+def combine_summaries(a, b):
+    """Combine two (seen, repeated) prefix bitsets.  A prefix is repeated in the result if it was repeated in
+    either input, or seen in both."""
+    return a[0] | b[0], a[1] | b[1] | (a[0] & b[0])
+
+def prefix_matches(prefix, test):
+    """test is either a set of prefixes, or a string that the prefix has to start with"""
+    if isinstance(test, str):
+        return prefix.startswith(test)
+    return prefix in test
+
+class CloseIndex:
+    """glom's close argument, compiled against a Concordance.
+
+    close maps a prefix to a dict from identifiers with that prefix (say MONDOs) to the identifiers they are
+    only a close match to.  glom mustn't build a set that contains both ends of one of those.  Instead of
+    walking every close match of every MONDO in each candidate set, we invert the map (close_to: id -> the
+    MONDO ids it is close to), and keep two small sets per clique that holds any of them: the MONDOs in the
+    clique that have close matches (holders), and the MONDOs that something in the clique is close to
+    (targets).  A merge is bad exactly when the union of the holders meets the union of the targets.
+
+    The per-clique sets are only kept up to date by glom_ids, so build a new index for each glom call."""
+    def __init__(self, concord, close):
+        self.close_to = {}
+        self.holders = {}
+        self.targets = {}
+        for cpref, closedict in close.items():
+            for pident, matches in closedict.items():
+                if not pident.startswith(cpref):
+                    continue
+                p = concord.intern(pident)
+                for match in matches:
+                    self.close_to.setdefault(concord.intern(match), set()).add(p)
+                self._add_holder(concord, p)
+        for ident, ps in self.close_to.items():
+            if concord.parent[ident] >= 0:
+                self.targets.setdefault(concord.find_id(ident), set()).update(ps)
+
+    def _add_holder(self, concord, p):
+        if concord.parent[p] >= 0:
+            self.holders.setdefault(concord.find_id(p), set()).add(p)
+        else:
+            self.holders.setdefault(p, set()).add(p)
+
+    def check(self, roots, new_ids):
+        """Returns (holders, targets) for the merged clique, or None if it would turn a close match into an
+        exact match"""
+        holders = set()
+        targets = set()
+        for root in roots:
+            holders.update(self.holders.get(root, ()))
+            targets.update(self.targets.get(root, ()))
+        for ident in new_ids:
+            holders.update(self.holders.get(ident, ()))
+            targets.update(self.close_to.get(ident, ()))
+        if not holders.isdisjoint(targets):
+            return None
+        return holders, targets
+
+    def merged(self, root, old_roots, holders, targets):
+        for old in old_roots:
+            self.holders.pop(old, None)
+            self.targets.pop(old, None)
+        if holders:
+            self.holders[root] = holders
+        if targets:
+            self.targets[root] = targets
+
+class GlomMetrics:
+    """Describes one glom call for concord.metrics.  It only reads the running counters the Concordance keeps
+    anyway (groups rejected by each rule, biggest clique so far) at the start and end of the call, so it's
+    cheap enough to always have on."""
+    def __init__(self, concord, kind, pref, unique_prefixes):
+        self.concord = concord
+        self.record = {'stage': concord.stage, 'call': len(concord.metrics), 'kind': kind, 'pref': pref,
+                       'unique_prefixes': list(unique_prefixes), 'largest_before': concord.largest}
+        self.rejections = dict(concord.rejections)
+        self.start = time.perf_counter()
+
+    def finish(self, groups):
+        concord = self.concord
+        rejected = {rule: count - self.rejections.get(rule, 0) for rule, count in concord.rejections.items()
+                    if count > self.rejections.get(rule, 0)}
+        self.record.update({'groups': groups, 'merged': groups - sum(rejected.values()), 'rejected': rejected,
+                            'largest_after': concord.largest, 'seconds': round(time.perf_counter() - self.start, 3)})
+        concord.metrics.append(self.record)
+        return self.record
+
+class Concordance:
+    """A union-find replacement for the dict-of-shared-sets that glom has traditionally built.
+
+    Every identifier that has been glommed is a key.  Instead of pointing each key at a python set that
+    gets copied every time two cliques are merged, each key points at a parent, and the root of each tree
+    stands for the clique.  Merges are union-by-size with path compression, so they cost amortized
+    O(alpha(n)) instead of O(size of clique).
+
+    Members of a clique are kept on a circular linked list (next pointers), and merging two cliques is
+    just swapping the next pointers of their roots, so we can still enumerate a clique without keeping
+    a set for it.
+
+    Identifiers are interned in a CurieTable, and the structure itself is three int32 arrays indexed by
+    the interned id.  An id that has been interned but never made it into a clique has a parent of -1.
+    The *_id methods work on interned ids; everything else takes and returns CURIE strings.
+
+    Each root also carries a summary of the prefixes in its clique, as two bitsets over prefix codes: which
+    prefixes have been seen at all, and which have been seen more than once.  That's all the unique_prefixes
+    and forbidden prefix checks need, and two summaries combine with a few bitwise ops, so checking a merge
+    costs O(number of prefixes) no matter how big the cliques are.  The low 64 prefix codes live in uint64
+    arrays; any bits above that go in the wide_summaries dict, which stays empty unless a build has more than
+    64 prefixes.
+
+    If max_clique_size is set, glom won't grow a clique past it.  Groups that would have are left out and
+    kept in quarantine, as (members of the group, size the clique would have been), so that one bad xref
+    can't quietly drag thousands of identifiers together.
+
+    Every glom call adds a record to metrics (see GlomMetrics); set stage to say which part of a build is
+    running.
+
+    The class looks enough like the old dict that the loaders can keep using it the same way:
+    `x in concord`, `concord[x]` (a set of the clique members), keys(), values() and items()."""
+    def __init__(self, max_clique_size=None):
+        self.curies = CurieTable()
+        self.parent = array('i')
+        self.next = array('i')
+        self.size = array('i')
+        self.seen = array('Q')
+        self.repeated = array('Q')
+        self.wide_summaries = {}
+        self.count = 0
+        self._prefix_masks = {}
+        #a BuildLog, if somebody wants one kept
+        self.log = None
+        self.max_clique_size = max_clique_size
+        self.quarantine = []
+        self.stage = None
+        self.metrics = []
+        self.rejections = defaultdict(int)
+        self.largest = 0
+
+    @classmethod
+    def from_dict(cls, conc_set, unique_prefixes=['INCHIKEY']):
+        """Build a Concordance from an old-style dict where each key points to its equivalence set.  The sets
+        are glommed with glom_structures, so sets that share a member (old UniChem pickles have them) are only
+        merged if that doesn't break unique_prefixes."""
+        concord = cls()
+        seen = set()
+        eqsets = []
+        for eqset in conc_set.values():
+            if id(eqset) in seen:
+                continue
+            seen.add(id(eqset))
+            eqsets.append(eqset)
+        concord.glom_structures(eqsets, unique_prefixes=unique_prefixes)
+        return concord
+
+    def save(self, fname):
+        """Write the concordance to fname.  It's the raw arrays (see array_file), which is a lot smaller and
+        faster to read back than a pickle of the old dict of sets."""
+        n = len(self.curies)
+        meta, arrays = self.curies.to_arrays()
+        arrays = {f'curies.{name}': arr for name, arr in arrays.items()}
+        for name in ['parent', 'next', 'size', 'seen', 'repeated']:
+            arrays[name] = getattr(self, name)[:n]
+        meta = {'curies': meta, 'count': self.count, 'largest': self.largest,
+                'wide_summaries': [[root, seen, repeated] for root, (seen, repeated) in self.wide_summaries.items()]}
+        write_arrays(fname, meta, arrays)
+
+    @classmethod
+    def load(cls, fname):
+        """Read a concordance written by save"""
+        meta, arrays = read_arrays(fname)
+        concord = cls()
+        concord.curies = CurieTable.from_arrays(meta['curies'],
+                                                {name[len('curies.'):]: arr for name, arr in arrays.items() if name.startswith('curies.')})
+        for name in ['parent', 'next', 'size', 'seen', 'repeated']:
+            setattr(concord, name, arrays[name])
+        concord.count = meta['count']
+        concord.largest = meta.get('largest', 0)
+        concord.wide_summaries = {root: (seen, repeated) for root, seen, repeated in meta['wide_summaries']}
+        return concord
+
+    def intern(self, element):
+        """Intern element, making room for it in the arrays, but don't put it in a clique"""
+        ident = self.curies.intern(element)
+        if len(self.parent) <= ident:
+            #grow in chunks, the slots past the end of the CurieTable just stay at -1
+            grow = max(ident + 1 - len(self.parent), 65536)
+            self.parent.extend(array('i', [-1]) * grow)
+            self.next.extend(array('i', [-1]) * grow)
+            self.size.extend(array('i', [0]) * grow)
+            self.seen.extend(array('Q', [0]) * grow)
+            self.repeated.extend(array('Q', [0]) * grow)
+        return ident
+
+    def add_id(self, element):
+        """Intern element and add it as its own clique if it isn't in one already.  Returns the id."""
+        return self.add_interned(self.intern(element))
+
+    def add_interned(self, ident):
+        if self.parent[ident] < 0:
+            self.parent[ident] = ident
+            self.next[ident] = ident
+            self.size[ident] = 1
+            self.set_summary(ident, 1 << self.curies.prefix_of[ident], 0)
+            self.count += 1
+            self.largest = max(self.largest, 1)
+        return ident
+
+    def add(self, element):
+        """Add element as its own clique, if we haven't seen it already"""
+        self.add_id(element)
+
+    def add_group(self, group):
+        """Unconditionally merge everything in group into one clique.  No checking, see glom for that."""
+        root = None
+        for element in group:
+            ident = self.add_id(element)
+            root = self.find_id(ident) if root is None else self.union_ids(root, ident)
+
+    def get_id(self, element):
+        """The interned id of element if it is in the concordance, otherwise None"""
+        ident = self.curies.get_id(element)
+        if ident is None or ident >= len(self.parent) or self.parent[ident] < 0:
+            return None
+        return ident
+
+    def find_id(self, ident):
+        parent = self.parent
+        while parent[ident] != ident:
+            #path halving
+            parent[ident] = parent[parent[ident]]
+            ident = parent[ident]
+        return ident
+
+    def union_ids(self, a, b):
+        """Merge the cliques containing ids a and b, returning the new root"""
+        ra = self.find_id(a)
+        rb = self.find_id(b)
+        if ra == rb:
+            return ra
+        if self.size[ra] < self.size[rb]:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        self.size[ra] += self.size[rb]
+        self.size[rb] = 0
+        if self.size[ra] > self.largest:
+            self.largest = self.size[ra]
+        self.set_summary(ra, *combine_summaries(self.summary(ra), self.summary(rb)))
+        self.wide_summaries.pop(rb, None)
+        #splice the two member rings together
+        self.next[ra], self.next[rb] = self.next[rb], self.next[ra]
+        return ra
+
+    def summary(self, root):
+        """(seen, repeated) prefix bitsets for the clique rooted at root"""
+        seen = self.seen[root]
+        repeated = self.repeated[root]
+        if root in self.wide_summaries:
+            wide_seen, wide_repeated = self.wide_summaries[root]
+            seen |= wide_seen << 64
+            repeated |= wide_repeated << 64
+        return seen, repeated
+
+    def set_summary(self, root, seen, repeated):
+        self.seen[root] = seen & LOW_64
+        self.repeated[root] = repeated & LOW_64
+        if seen >> 64:
+            self.wide_summaries[root] = (seen >> 64, repeated >> 64)
+        else:
+            self.wide_summaries.pop(root, None)
+
+    def prefix_mask(self, test):
+        """Bitset of the prefix codes whose prefix passes test.  Cached by test, until new prefixes show up."""
+        prefixes = self.curies.prefixes
+        cached = self._prefix_masks.get(test)
+        if cached is not None and cached[0] == len(prefixes):
+            return cached[1]
+        mask = 0
+        for code, prefix in enumerate(prefixes):
+            if prefix is not None and prefix_matches(prefix, test):
+                mask |= 1 << code
+        self._prefix_masks[test] = (len(prefixes), mask)
+        return mask
+
+    def member_ids(self, ident):
+        """Iterate over the ids in the clique containing ident"""
+        start = self.find_id(ident)
+        yield start
+        current = self.next[start]
+        while current != start:
+            yield current
+            current = self.next[current]
+
+    def members(self, element):
+        """Iterate over the members of the clique containing element"""
+        ident = self.get_id(element)
+        if ident is None:
+            raise KeyError(element)
+        for member in self.member_ids(ident):
+            yield self.curies.curie(member)
+
+    def clique_size(self, element):
+        return self.size[self.find_id(self.get_id(element))]
+
+    def glom(self, newgroups, unique_prefixes=['INCHIKEY'], pref='HP', close={}):
+        """Same contract as babel_utils.glom: merge each new group with whatever cliques its members are
+        already in, unless the result would contain more than one identifier of a unique prefix, or would
+        turn a close match into an exact match.  Blows up if the result contains a forbidden prefix.
+        Unlike the dict version, an identifier of a close prefix that isn't in its close dict is taken to have
+        no close matches, rather than raising a KeyError."""
+        index = CloseIndex(self, close) if close else None
+        metrics = GlomMetrics(self, 'glom', pref, unique_prefixes)
+        log = self.log
+        if log is not None:
+            log.begin(unique_prefixes, close)
+        n = 0
+        bad = 0
+        for group in newgroups:
+            n += 1
+            #dict.fromkeys to drop repeats while keeping the order of the group.
+            #Everything gets interned up front; if the group is rejected the new ids just never get a parent.
+            group_ids = [self.intern(element) for element in dict.fromkeys(group)]
+            if log is not None:
+                log.add(group_ids)
+                if log.capturing:
+                    continue
+            if not self.glom_ids(group_ids, unique_prefixes, index):
+                bad += 1
+        if log is None or not log.capturing:
+            metrics.finish(n)
+
+    def glom_structures(self, groups, unique_prefixes=['INCHIKEY']):
+        """glom groups that each describe one structure (UniChem's, say) with unique_prefixes.  A group that's
+        rejected because some of its members are already in another structure's clique isn't lost: the rest of
+        it, INCHIKEY included, still goes in as a clique of its own."""
+        def with_leftovers():
+            for group in groups:
+                group = list(group)
+                yield group
+                #glom takes the groups one at a time, so by now this one is either in or rejected
+                leftover = [element for element in group if element not in self]
+                if 0 < len(leftover) < len(group):
+                    yield leftover
+        self.glom(with_leftovers(), unique_prefixes=unique_prefixes)
+
+    def glom_ids(self, group_ids, unique_prefixes=['INCHIKEY'], close=None):
+        """glom a single group of interned ids.  close is a CloseIndex, or None.
+        Returns True if the group was merged in, False if it was rejected."""
+        prefix_of = self.curies.prefix_of
+        parent = self.parent
+        roots = set()
+        new_ids = []
+        for ident in group_ids:
+            if parent[ident] < 0:
+                new_ids.append(ident)
+            else:
+                roots.add(self.find_id(ident))
+        #Summarize the prefixes of everything that would end up in the merged set
+        summary = (0, 0)
+        for root in roots:
+            summary = combine_summaries(summary, self.summary(root))
+        for ident in new_ids:
+            summary = combine_summaries(summary, (1 << prefix_of[ident], 0))
+        seen, repeated = summary
+        forbidden = seen & self.prefix_mask(FORBIDDEN_PREFIXES)
+        if forbidden:
+            prefix = self.curies.prefixes[forbidden.bit_length() - 1]
+            print(prefix)
+            raise ValueError(f'Forbidden prefix {prefix}')
+        #make sure we didn't combine anything we want to keep separate
+        if not self._unique_prefixes_ok(summary, unique_prefixes):
+            self.rejections['unique_prefixes'] += 1
+            return False
+        if self.max_clique_size is not None and (len(roots) > 1 or new_ids):
+            new_size = len(new_ids) + sum([self.size[root] for root in roots])
+            if new_size > self.max_clique_size:
+                self.quarantine.append(([self.curies.curie(ident) for ident in group_ids], new_size))
+                self.rejections['max_clique_size'] += 1
+                return False
+        #Now check the 'close' index to see if we've accidentally gotten to a close match becoming an exact match
+        if close is not None:
+            signature = close.check(roots, new_ids)
+            if signature is None:
+                self.rejections['close'] += 1
+                return False
+        root = None
+        for ident in new_ids:
+            self.add_interned(ident)
+            root = ident if root is None else self.union_ids(root, ident)
+        for other in roots:
+            root = other if root is None else self.union_ids(root, other)
+        if close is not None:
+            close.merged(root, list(roots) + new_ids, *signature)
+        return True
+
+    def _unique_prefixes_ok(self, summary, unique_prefixes):
+        """glom has always compared identifiers with startswith, so 'INCHI' also catches INCHIKEYs.  Since the
+        unique prefixes never contain a colon, that's the same as comparing the prefixes.  A unique prefix is
+        broken if any matching prefix shows up twice, or if more than one matching prefix shows up at all."""
+        seen, repeated = summary
+        for up in unique_prefixes:
+            mask = self.prefix_mask(up)
+            if repeated & mask:
+                return False
+            matched = seen & mask
+            if matched & (matched - 1):
+                return False
+        return True
+
+    def __contains__(self, element):
+        return self.get_id(element) is not None
+
+    def __getitem__(self, element):
+        return set(self.members(element))
+
+    def __len__(self):
+        return self.count
+
+    def key_ids(self):
+        for ident, parent in enumerate(self.parent):
+            if parent >= 0:
+                yield ident
+
+    def __iter__(self):
+        for ident in self.key_ids():
+            yield self.curies.curie(ident)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        """Like dict.items() on the old concordance: every key is paired with its clique, and all the keys in
+        a clique share one set object."""
+        built = {}
+        for ident in self.key_ids():
+            root = self.find_id(ident)
+            if root not in built:
+                built[root] = set([self.curies.curie(member) for member in self.member_ids(root)])
+            yield self.curies.curie(ident), built[root]
+
+    def cliques(self):
+        """Yield each clique once, as a frozenset of its members.  This walks the roots, so unlike
+        set([frozenset(x) for x in concord.values()]) it never builds more than one set at a time."""
+        parent = self.parent
+        for ident in self.key_ids():
+            if parent[ident] == ident:
+                yield frozenset([self.curies.curie(member) for member in self.member_ids(ident)])
+
+    def values(self):
+        for _, clique in self.items():
+            yield clique
@@ -0,0 +1,126 @@
+from array import array
+import zlib
+
+class CurieTable:
+    """Interns CURIEs as small integers so that big concordances don't have to hold tens of millions of
+    python strings.
+
+    Each prefix is stored once and given a small code.  The local part of every CURIE is appended to a
+    single bytearray (the arena), and the integer id of a CURIE is just its position in the parallel
+    arrays below.  Lookups go through an open-addressing hash table of ids keyed on the crc32 of the CURIE,
+    which is stable across runs, so everything in here can be written to disk and read back as-is.
+
+    CURIEs are only turned back into python strings when somebody asks for them with curie()."""
+    def __init__(self):
+        #code -> prefix.  A prefix of None means the identifier had no colon in it at all.
+        self.prefixes = []
+        self.prefix_codes = {}
+        #id -> prefix code
+        self.prefix_of = array('H')
+        #id -> [offsets[id], offsets[id+1]) is the local id in the arena
+        self.offsets = array('Q', [0])
+        self.arena = bytearray()
+        #id -> crc32 of the curie
+        self.hashes = array('I')
+        #the hash table: -1 is an empty slot, otherwise an id
+        self.slots = array('i', [-1]) * 8
+
+    def __len__(self):
+        return len(self.prefix_of)
+
+    @staticmethod
+    def split(curie):
+        if ':' in curie:
+            prefix, local = curie.split(':', 1)
+            return prefix, local
+        return None, curie
+
+    def get_prefix_code(self, prefix):
+        code = self.prefix_codes.get(prefix)
+        if code is None:
+            code = len(self.prefixes)
+            self.prefixes.append(prefix)
+            self.prefix_codes[prefix] = code
+        return code
+
+    def _probe(self, curie):
+        """Return (id or -1, slot, hash, prefix code or None, local bytes) for curie"""
+        prefix, sep, local = curie.partition(':')
+        if not sep:
+            prefix, local = None, curie
+        local = local.encode()
+        code = self.prefix_codes.get(prefix)
+        h = zlib.crc32(curie.encode())
+        slots = self.slots
+        mask = len(slots) - 1
+        i = h & mask
+        while True:
+            ident = slots[i]
+            if ident < 0:
+                return -1, i, h, code, local
+            if code is not None and self.hashes[ident] == h and self.prefix_of[ident] == code \
+                    and self.arena[self.offsets[ident]:self.offsets[ident + 1]] == local:
+                return ident, i, h, code, local
+            i = (i + 1) & mask
+
+    def get_id(self, curie):
+        """The id for curie, or None if we have never seen it"""
+        ident = self._probe(curie)[0]
+        if ident < 0:
+            return None
+        return ident
+
+    def intern(self, curie):
+        """The id for curie, adding it to the table if need be"""
+        ident, slot, h, code, local = self._probe(curie)
+        if ident >= 0:
+            return ident
+        if code is None:
+            code = self.get_prefix_code(self.split(curie)[0])
+        ident = len(self.prefix_of)
+        self.prefix_of.append(code)
+        self.arena.extend(local)
+        self.offsets.append(len(self.arena))
+        self.hashes.append(h)
+        self.slots[slot] = ident
+        if 2 * len(self.prefix_of) > len(self.slots):
+            self._grow()
+        return ident
+
+    def _grow(self):
+        slots = array('i', [-1]) * (2 * len(self.slots))
+        mask = len(slots) - 1
+        for ident, h in enumerate(self.hashes):
+            i = h & mask
+            while slots[i] >= 0:
+                i = (i + 1) & mask
+            slots[i] = ident
+        self.slots = slots
+
+    def to_arrays(self):
+        """(meta, arrays) for array_file.write_arrays"""
+        arrays = {'prefix_of': self.prefix_of, 'offsets': self.offsets, 'arena': array('B', self.arena),
+                  'hashes': self.hashes, 'slots': self.slots}
+        return {'prefixes': self.prefixes}, arrays
+
+    @classmethod
+    def from_arrays(cls, meta, arrays):
+        table = cls()
+        table.prefixes = meta['prefixes']
+        table.prefix_codes = {prefix: code for code, prefix in enumerate(table.prefixes)}
+        table.prefix_of = arrays['prefix_of']
+        table.offsets = arrays['offsets']
+        table.arena = bytearray(arrays['arena'])
+        table.hashes = arrays['hashes']
+        table.slots = arrays['slots']
+        return table
+
+    def prefix(self, ident):
+        return self.prefixes[self.prefix_of[ident]]
+
+    def curie(self, ident):
+        local = self.arena[self.offsets[ident]:self.offsets[ident + 1]].decode()
+        prefix = self.prefixes[self.prefix_of[ident]]
+        if prefix is None:
+            return local
+        return f'{prefix}:{local}'
@@ -1,4 +1,5 @@
-from babel.babel_utils import glom, write_compendium, dump_sets, dump_dicts, get_prefixes, filter_out_non_unique_ids, clean_sets
+from babel.babel_utils import glom, write_compendium, dump_sets, dump_dicts, get_prefixes, filter_out_non_unique_ids, clean_sets, dump_quarantine, max_clique_size, write_metrics
+from babel.concordance import Concordance
 from babel.onto import Onto
 from babel.ubergraph import UberGraph
 from src.util import Text
@@ -115,7 +116,7 @@ def load_diseases_and_phenotypes():
     meddra_umls = read_meddra(bad_umls)
     meddra_umls = filter_umls(meddra_umls,mondo_sets+hpo_sets)
     dump_sets(meddra_umls,'meddra_umls_sets.txt')
-    dicts = {}
+    dicts = Concordance(max_clique_size=max_clique_size('disease_phenotype'))
     #EFO has 3 parts that we want here:
     # Disease
     efo_sets_1,l = build_exact_sets('EFO:0000408')
@@ -132,19 +133,25 @@ def load_diseases_and_phenotypes():
     dump_sets(efo_sets,'efo_sets.txt')
     print('put it all together')
     print('mondo')
+    dicts.stage = 'mondo'
     glom(dicts,mondo_sets,unique_prefixes=['MONDO'])
     dump_dicts(dicts,'mondo_dicts.txt')
     print('hpo')
+    dicts.stage = 'hpo'
     glom(dicts,hpo_sets,unique_prefixes=['MONDO'],pref='HP')
     dump_dicts(dicts,'mondo_hpo_dicts.txt')
     print('umls')
+    dicts.stage = 'umls'
     glom(dicts,meddra_umls,unique_prefixes=['MONDO'],pref='UMLS',close={'MONDO':mondo_close})
     dump_dicts(dicts,'mondo_hpo_meddra_dicts.txt')
     print('efo')
+    dicts.stage = 'efo'
     glom(dicts,efo_sets,unique_prefixes=['MONDO'],pref='EFO')
     dump_dicts(dicts,'mondo_hpo_meddra_efo_dicts.txt')
     print('dump it')
-    diseases,phenotypes = create_typed_sets(set([frozenset(x) for x in dicts.values()]))
+    dump_quarantine(dicts,'disease_phenotype_quarantine.txt')
+    write_metrics(dicts,'disease_phenotype_glom_metrics.jsonl')
+    diseases,phenotypes = create_typed_sets(dicts.cliques())
     write_compendium(diseases,'disease.txt','biolink:Disease',labels)
     write_compendium(phenotypes,'phenotypes.txt','biolink:PhenotypicFeature',labels)
 
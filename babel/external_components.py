@@ -0,0 +1,158 @@
+import os
+import math
+import shutil
+import tempfile
+import zlib
+
+from babel.babel_utils import get_config, make_local_name
+
+#Rough bytes of python memory per byte of pair file text, once the nodes of a partition are in a dict
+MEMORY_PER_BYTE = 8
+#Each partition keeps a few files open at once, so don't go wild
+MAX_PARTITIONS = 1000
+
+class ExternalComponents:
+    """Connected components of a pair graph that is too big to hold in memory.
+
+    Pairs are staged to disk as they are added.  When the cliques are asked for, the edges are hash
+    partitioned by node into enough partitions that one partition's labels fit under memory_limit, and
+    then every node's label is iteratively lowered to the smallest identifier in its component by label
+    propagation: each round streams every partition's edges against that partition's labels, sending
+    messages to the partitions of the neighbors, and only nodes whose label changed in the last round
+    send anything.  It stops when a round changes nothing, which takes about as many rounds as the
+    diameter of the biggest component (a handful for UniChem and MeSH style stars).
+
+    This is raw equivalence: unlike glom, it does not apply unique_prefixes or close rules.  cliques()
+    yields sets of identifiers, which is what write_compendium consumes."""
+    def __init__(self, workdir=None, memory_limit=None):
+        """The working files go in a new directory under workdir (by default, the download directory)"""
+        if memory_limit is None:
+            memory_limit = get_config().get('external_memory_limit_mb', 4096) * 1024 * 1024
+        self.memory_limit = memory_limit
+        if workdir is None:
+            workdir = make_local_name('')
+        os.makedirs(workdir, exist_ok=True)
+        #cleanup removes the whole working directory, so it's always one of our own, under the one we're given
+        self.workdir = tempfile.mkdtemp(prefix='components_', dir=workdir)
+        self.staged = os.path.join(self.workdir, 'pairs.txt')
+        self.staged_file = open(self.staged, 'w')
+
+    def add_pair(self, a, b):
+        self.staged_file.write(f'{a}\t{b}\n')
+
+    def add_pairs(self, pairs):
+        for a, b in pairs:
+            self.staged_file.write(f'{a}\t{b}\n')
+
+    def add_singleton(self, a):
+        """Make sure that a shows up in the output even if it doesn't pair with anything"""
+        self.staged_file.write(f'{a}\t{a}\n')
+
+    def _path(self, kind, partition):
+        return os.path.join(self.workdir, f'{kind}.{partition}')
+
+    def _partition_of(self, node):
+        return zlib.crc32(node.encode()) % self.npartitions
+
+    def _partition_edges(self):
+        self.staged_file.close()
+        size = 2 * os.path.getsize(self.staged)
+        self.npartitions = max(1, math.ceil(size * MEMORY_PER_BYTE / self.memory_limit))
+        if self.npartitions > MAX_PARTITIONS:
+            print(f'Would need {self.npartitions} partitions to stay under the memory limit, using {MAX_PARTITIONS}')
+            self.npartitions = MAX_PARTITIONS
+        outs = [open(self._path('edges', p), 'w') for p in range(self.npartitions)]
+        nodes = [open(self._path('labels', p), 'w') for p in range(self.npartitions)]
+        with open(self.staged, 'r') as inf:
+            for line in inf:
+                a, b = line.rstrip('\n').split('\t')
+                pa = self._partition_of(a)
+                pb = self._partition_of(b)
+                outs[pa].write(f'{a}\t{b}\n')
+                outs[pb].write(f'{b}\t{a}\n')
+                #every node starts out labelled with itself, and active
+                nodes[pa].write(f'{a}\t{a}\t1\n')
+                nodes[pb].write(f'{b}\t{b}\t1\n')
+        for f in outs + nodes:
+            f.close()
+        os.remove(self.staged)
+
+    def _read_labels(self, partition):
+        labels = {}
+        active = set()
+        with open(self._path('labels', partition), 'r') as inf:
+            for line in inf:
+                node, label, changed = line.rstrip('\n').split('\t')
+                labels[node] = label
+                if changed == '1':
+                    active.add(node)
+        return labels, active
+
+    def _write_labels(self, partition, labels, changed):
+        with open(self._path('labels', partition), 'w') as outf:
+            for node, label in labels.items():
+                outf.write(f'{node}\t{label}\t{1 if node in changed else 0}\n')
+
+    def _propagate(self):
+        """One round of label propagation.  Returns the number of labels that changed."""
+        messages = [open(self._path('messages', p), 'w') for p in range(self.npartitions)]
+        for p in range(self.npartitions):
+            labels, active = self._read_labels(p)
+            if len(active) == 0:
+                continue
+            with open(self._path('edges', p), 'r') as inf:
+                for line in inf:
+                    a, b = line.rstrip('\n').split('\t')
+                    if a in active:
+                        messages[self._partition_of(b)].write(f'{b}\t{labels[a]}\n')
+        for f in messages:
+            f.close()
+        nchanged = 0
+        for p in range(self.npartitions):
+            labels, _ = self._read_labels(p)
+            changed = set()
+            with open(self._path('messages', p), 'r') as inf:
+                for line in inf:
+                    node, label = line.rstrip('\n').split('\t')
+                    if label < labels[node]:
+                        labels[node] = label
+                        changed.add(node)
+            nchanged += len(changed)
+            self._write_labels(p, labels, changed)
+            os.remove(self._path('messages', p))
+        return nchanged
+
+    def cliques(self):
+        """Compute the components and yield each one as a set of identifiers.  The working files are removed
+        once the cliques have all been read out."""
+        try:
+            for clique in self._cliques():
+                yield clique
+        finally:
+            self.cleanup()
+
+    def _cliques(self):
+        self._partition_edges()
+        while self._propagate() > 0:
+            pass
+        #regroup by label, so that each clique lands entirely in one partition
+        groups = [open(self._path('groups', p), 'w') for p in range(self.npartitions)]
+        for p in range(self.npartitions):
+            labels, _ = self._read_labels(p)
+            for node, label in labels.items():
+                groups[self._partition_of(label)].write(f'{label}\t{node}\n')
+        for f in groups:
+            f.close()
+        for p in range(self.npartitions):
+            cliques = {}
+            with open(self._path('groups', p), 'r') as inf:
+                for line in inf:
+                    label, node = line.rstrip('\n').split('\t')
+                    cliques.setdefault(label, set()).add(node)
+            for clique in cliques.values():
+                yield clique
+
+    def cleanup(self):
+        if not self.staged_file.closed:
+            self.staged_file.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
@@ -0,0 +1,177 @@
+from functools import lru_cache
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+from babel.big_gz_sort import batch_sort
+from babel.block_file import EXTENSIONS, read_block_at, remove_files
+
+MAGIC = b'BABEL-ID-INDEX 1\n'
+
+def id_index_name(fname):
+    return f'{fname}.ids'
+
+class IdIndexWriter:
+    """Builds the identifier index of a compendium (or any file of lines): every identifier, sorted, with the
+    byte offset of its line, or, for block compressed files, of its block along with its line number in the
+    block.
+
+    The file is a magic line, one line of json giving the key width and entry count, and then the entries,
+    each the utf-8 identifier padded with NULs to the width of the longest one, an unsigned 64 bit offset and
+    an unsigned 32 bit line number, little endian.  Since the entries are all the same size and in order, the
+    file can be mmapped and binary searched in place (see IdIndex).
+
+    Entries are staged to disk as they're added and sorted with big_gz_sort at close, so the index of the
+    biggest compendia doesn't have to fit in memory.  Identifiers can't contain tabs or newlines.  close is
+    finish, which does the sort and writes the index under a temporary name, and then publish, which renames
+    it into place; the compendium writers call the two separately so that nothing is renamed until every
+    file of a compendium is done.  abort throws the files away instead."""
+    def __init__(self, fname, buffer_size=1000000):
+        self.fname = fname
+        self.buffer_size = buffer_size
+        self.width = 0
+        self.count = 0
+        self.staged = f'{fname}.unsorted'
+        self.stagef = open(self.staged, 'wb')
+
+    def add(self, identifiers, offset, line=0):
+        for identifier in identifiers:
+            key = identifier.encode('utf-8')
+            if len(key) > self.width:
+                self.width = len(key)
+            #tab sorts before anything that shows up in an identifier, so the lines sort by identifier
+            self.stagef.write(b'%s\t%d\t%d\n' % (key, offset, line))
+        self.count += len(identifiers)
+
+    def finish(self):
+        self.stagef.close()
+        sorted_name = f'{self.fname}.sorted'
+        #the sort's chunk files get fixed names, so give them a directory of their own
+        tempdir = tempfile.mkdtemp(prefix='id_index_', dir=os.path.dirname(os.path.abspath(self.fname)))
+        try:
+            with open(self.staged, 'rb') as inf, open(sorted_name, 'wb') as outf:
+                batch_sort(inf, outf, buffer_size=self.buffer_size, tempdirs=[tempdir])
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+        os.remove(self.staged)
+        entry = struct.Struct(f'<{self.width}sQI')
+        header = {'width': self.width, 'count': self.count, 'entry_size': entry.size}
+        with open(sorted_name, 'rb') as inf, open(f'{self.fname}.tmp', 'wb') as outf:
+            outf.write(MAGIC)
+            outf.write(json.dumps(header).encode())
+            outf.write(b'\n')
+            for staged in inf:
+                key, offset, line = staged.rstrip(b'\n').split(b'\t')
+                outf.write(entry.pack(key, int(offset), int(line)))
+        os.remove(sorted_name)
+
+    def publish(self):
+        os.replace(f'{self.fname}.tmp', self.fname)
+
+    def close(self):
+        self.finish()
+        self.publish()
+
+    def abort(self):
+        self.stagef.close()
+        remove_files(self.staged, f'{self.fname}.sorted', f'{self.fname}.tmp')
+
+class IdIndex:
+    """Looks identifiers up in an index written by IdIndexWriter, by binary search over the mmapped file."""
+    def __init__(self, fname):
+        self.inf = open(fname, 'rb')
+        if self.inf.readline() != MAGIC:
+            raise ValueError(f'{fname} is not an identifier index')
+        header = json.loads(self.inf.readline())
+        self.start = self.inf.tell()
+        self.width = header['width']
+        self.count = header['count']
+        self.entry = struct.Struct(f'<{self.width}sQI')
+        self.mm = mmap.mmap(self.inf.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def _key(self, i):
+        start = self.start + i * self.entry.size
+        return self.mm[start:start + self.width]
+
+    def positions(self, identifier):
+        """[(offset, line)] for every entry of identifier, in offset order"""
+        key = identifier.encode('utf-8')
+        if len(key) > self.width:
+            return []
+        key = key.ljust(self.width, b'\0')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < self.count and self._key(lo) == key:
+            _, offset, line = self.entry.unpack_from(self.mm, self.start + lo * self.entry.size)
+            found.append((offset, line))
+            lo += 1
+        #the staged lines sorted the offsets as text
+        return sorted(found)
+
+    def close(self):
+        self.mm.close()
+        self.inf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class CompendiumIndex:
+    """Finds the records of a compendium that contain an identifier, using the compendium's identifier index
+    (fname.ids), without reading the compendium in.  Works on plain and block compressed compendia.  Plain
+    compendia are mmapped, and for compressed ones the last few blocks read are kept decompressed."""
+    def __init__(self, fname, cached_blocks=16):
+        self.fname = fname
+        self.compression = None
+        for compression, extension in EXTENSIONS.items():
+            if fname.endswith(extension):
+                self.compression = compression
+        self.index = IdIndex(id_index_name(fname))
+        self.inf = open(fname, 'rb')
+        if self.compression is None:
+            self.mm = mmap.mmap(self.inf.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._block = lru_cache(maxsize=cached_blocks)(self._read_block)
+
+    def _read_block(self, offset):
+        return read_block_at(self.inf, offset, self.compression)
+
+    def lines(self, identifier):
+        """The records (as bytes) that identifier is in"""
+        lines = []
+        for offset, line in self.index.positions(identifier):
+            if self.compression is None:
+                lines.append(self.mm[offset:self.mm.find(b'\n', offset) + 1])
+            else:
+                lines.append(self._block(offset)[line])
+        return lines
+
+    def find(self, identifier):
+        """The records (as dicts) that identifier is in.  Normally there's one, or none."""
+        return [json.loads(line) for line in self.lines(identifier)]
+
+    def close(self):
+        if self.compression is None:
+            self.mm.close()
+        self.index.close()
+        self.inf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
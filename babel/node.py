@@ -1,21 +1,49 @@
+import argparse
+from datetime import datetime as dt
+import json
+from json.encoder import encode_basestring
+import os
 import requests
-from src.util import Text
 from src.LabeledID import LabeledID
 from collections import defaultdict
 
+#self.url_base = 'http://arrival.edc.renci.org:32511/bl'
+URL_BASE = 'https://bl-lookup-sri.renci.org/bl'
+SNAPSHOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'biolink_snapshot.json')
+#The types that the compendia get written as
+COMPENDIUM_TYPES = ['biolink:AnatomicalEntity', 'biolink:BiologicalProcess', 'biolink:Cell', 'biolink:CellularComponent',
+                    'biolink:ChemicalSubstance', 'biolink:Disease', 'biolink:Gene', 'biolink:GeneFamily',
+                    'biolink:MolecularActivity', 'biolink:OrganismTaxon', 'biolink:Pathway', 'biolink:PhenotypicFeature']
+
 class NodeFactory:
-    def __init__(self):
-        #self.url_base = 'http://arrival.edc.renci.org:32511/bl'
-        self.url_base = 'https://bl-lookup-sri.renci.org/bl'
+    """Turns sets of equivalent identifiers into compendium nodes.
+
+    The ancestors and id_prefixes of each biolink type come from a local snapshot of the biolink model
+    service (biolink_snapshot.json, see refresh_snapshot), so that builds don't depend on the service being
+    up.  Types that aren't in the snapshot are still looked up from the service.  With a biolink_version, the
+    service is asked for that version of the model, and a snapshot of any other version is refused."""
+    def __init__(self, snapshot=SNAPSHOT, biolink_version=None):
+        self.url_base = URL_BASE
+        self.biolink_version = biolink_version
         self.ancestor_map = {}
         self.prefix_map = {}
+        self.plans = {}
         self.ignored_prefixes = set()
+        if snapshot is not None and os.path.exists(snapshot):
+            with open(snapshot, 'r') as inf:
+                model_snapshot = json.load(inf)
+            snapshot_version = model_snapshot.get('biolink_model_version')
+            if biolink_version is not None and snapshot_version != biolink_version:
+                raise ValueError(f'{snapshot} is of biolink model {snapshot_version}, not {biolink_version}.  Refresh it with python babel/node.py --refresh-snapshot')
+            for input_type, model in model_snapshot['types'].items():
+                self.ancestor_map[input_type] = model['ancestors']
+                self.prefix_map[input_type] = model['id_prefixes']
 
     def get_ancestors(self,input_type):
         if input_type in self.ancestor_map:
             return self.ancestor_map[input_type]
         url = f'{self.url_base}/{input_type}/ancestors'
-        response = requests.get(url)
+        response = requests.get(url, params=self.version_params())
         ancs = response.json()
         self.ancestor_map[input_type] = ancs
         return ancs
@@ -24,12 +52,17 @@ class NodeFactory:
         if input_type in self.prefix_map:
             return self.prefix_map[input_type]
         url = f'{self.url_base}/{input_type}'
-        response = requests.get(url)
+        response = requests.get(url, params=self.version_params())
         j = response.json()
         prefs = j['id_prefixes']
         self.prefix_map[input_type] = prefs
         return prefs
 
+    def version_params(self):
+        if self.biolink_version is None:
+            return {}
+        return {'version': self.biolink_version}
+
     def make_json_id(self,input):
         if isinstance(input,LabeledID):
             if input.label is not None and input.label != '':
@@ -78,57 +111,130 @@ class NodeFactory:
                 labeled_list.append(iid)
         return labeled_list
 
+    def get_plan(self,node_type):
+        if node_type not in self.plans:
+            self.plans[node_type] = NormalizationPlan(node_type,self.get_ancestors(node_type),self.get_prefixes(node_type))
+        return self.plans[node_type]
+
     def create_node(self,input_identifiers,node_type,labels={}):
         #This is where we will normalize, i.e. choose the best id, and add types in accord with BL.
         #we should also include provenance and version information for the node set build.
-        ancestors = self.get_ancestors(node_type)
-        ancestors.reverse()
-        prefixes = self.get_prefixes(node_type)
-        cleaned = self.apply_labels(input_identifiers,labels)
-        try:
-            idmap = defaultdict(list)
-            for i in list(cleaned):
-                idmap[Text.get_curie(i).upper()].append(i)
-        except AttributeError:
-            print('something very bad')
-            print(input_identifiers)
-            print(len(input_identifiers))
-            for i in list(input_identifiers):
-                print(i)
-                print(type(i))
-                print(Text.get_curie(i))
-                print(Text.get_curie(i).upper())
-            exit()
-        identifiers = []
-        accepted_ids = set()
-        #Converting identifiers from LabeledID to dicts
-        for p in prefixes:
-            pupper = p.upper()
-            if pupper in idmap:
-                for v in idmap[pupper]:
-                    newid = Text.recurie(v,p)
-                    identifiers.append(self.make_json_id(newid))
-                    accepted_ids.add(v)
-        #Warn if we have prefixes that we're ignoring
-        for k,vals in idmap.items():
-            for v in vals:
-                if v not in accepted_ids and (k,node_type) not in self.ignored_prefixes:
-                    print(f'Ignoring prefix {k} for type {node_type}, identifier {v}')
-                    self.ignored_prefixes.add( (k,node_type) )
-        if len(identifiers) == 0:
+        plan = self.get_plan(node_type)
+        ranked = []
+        for iid in input_identifiers:
+            if isinstance(iid,LabeledID):
+                print('LabeledID dont belong here, pass in labels seperately',iid)
+                exit()
+            prefix, sep, local = iid.partition(':')
+            if not sep:
+                print('something very bad')
+                print(input_identifiers)
+                print(len(input_identifiers))
+                exit()
+            spellings = plan.spellings.get(prefix)
+            if spellings is None:
+                spellings = plan.lookup(prefix)
+            if not spellings:
+                #Warn if we have prefixes that we're ignoring
+                upper = prefix.upper()
+                if (upper,node_type) not in self.ignored_prefixes:
+                    print(f'Ignoring prefix {upper} for type {node_type}, identifier {iid}')
+                    self.ignored_prefixes.add( (upper,node_type) )
+                continue
+            label = labels.get(iid) if labels else None
+            for rank, canonical in spellings:
+                ranked.append( (rank, len(ranked), f'{canonical}:{local}', label) )
+        if len(ranked) == 0:
             return None
-        best_id = identifiers[0]['identifier']
-        # identifiers is in preferred order, so choose the first non-empty label to be the node label
-        labels = list(filter(lambda x:len(x) > 0, [ l['label'] for l in identifiers if 'label' in l ]))
-        label = None
-        if len(labels) > 0:
-            label = labels[0]
-
+        #identifiers go in preferred prefix order, and in input order within a prefix
+        ranked.sort()
+        identifiers = [ {'identifier': ident, 'label': label} if label else {'identifier': ident} for _, _, ident, label in ranked ]
         node = {
-            'id': {'identifier':best_id,},
+            'id': {'identifier':identifiers[0]['identifier'],},
             'equivalent_identifiers': identifiers,
-            'type': [node_type] + ancestors
+            'type': plan.types
         }
-        if label is not None:
-            node['id']['label'] =  label
+        # identifiers is in preferred order, so choose the first non-empty label to be the node label
+        for _, _, _, label in ranked:
+            if label:
+                node['id']['label'] = label
+                break
         return node
+
+class NormalizationPlan:
+    """Everything create_node needs to know about a node type, worked out once: the rank of each
+    (uppercased) prefix in the type's preferred order along with its canonical spelling, and the type list
+    that goes on every node.  Nodes of a type all share that one type list, so don't modify it."""
+    def __init__(self,node_type,ancestors,prefixes):
+        self.ranks = defaultdict(list)
+        for rank, prefix in enumerate(prefixes):
+            self.ranks[prefix.upper()].append( (rank, prefix) )
+        self.ranks = dict(self.ranks)
+        self.types = [node_type] + ancestors[::-1]
+        #prefix, as it comes in -> ranks and spellings, so we only uppercase each spelling once
+        self.spellings = {}
+
+    def lookup(self,prefix):
+        self.spellings[prefix] = self.ranks.get(prefix.upper(), [])
+        return self.spellings[prefix]
+
+class NodeEncoder:
+    """Encodes the nodes that create_node makes for one type into the lines of a compendium, the same bytes
+    that jsonlines writes for them.  Every node of a type has the same type list, so its part of the line is
+    rendered once, and the rest is pasted together around the escaped strings instead of going through the
+    general purpose encoder.  Anything that isn't shaped like a create_node node goes to the json encoder."""
+    def __init__(self,types):
+        self.types = types
+        #same settings as jsonlines
+        self.fallback = json.JSONEncoder(ensure_ascii=False, separators=(', ', ': ')).encode
+        self.tail = f'], "type": {self.fallback(types)}}}\n'
+
+    def encode(self,node):
+        """The compendium line for node, newline included"""
+        try:
+            if node['type'] is not self.types or len(node) != 3:
+                return self.fallback(node) + '\n'
+            node_id = node['id']
+            if len(node_id) == 1:
+                head = '{"id": {"identifier": ' + encode_basestring(node_id['identifier']) + '}, "equivalent_identifiers": ['
+            elif len(node_id) == 2:
+                head = '{"id": {"identifier": ' + encode_basestring(node_id['identifier']) + ', "label": ' + encode_basestring(node_id['label']) + '}, "equivalent_identifiers": ['
+            else:
+                return self.fallback(node) + '\n'
+            parts = []
+            for ident in node['equivalent_identifiers']:
+                if len(ident) == 1:
+                    parts.append('{"identifier": ' + encode_basestring(ident['identifier']) + '}')
+                elif len(ident) == 2:
+                    parts.append('{"identifier": ' + encode_basestring(ident['identifier']) + ', "label": ' + encode_basestring(ident['label']) + '}')
+                else:
+                    return self.fallback(node) + '\n'
+            return head + ', '.join(parts) + self.tail
+        except (KeyError, TypeError):
+            #labels that aren't strings and the like
+            return self.fallback(node) + '\n'
+
+def refresh_snapshot(types=COMPENDIUM_TYPES, fname=SNAPSHOT, url_base=URL_BASE, biolink_version=None):
+    """Pull the ancestors and id_prefixes of each type, in biolink_version of the model, from the biolink model
+    service into a snapshot file"""
+    factory = NodeFactory(snapshot=None, biolink_version=biolink_version)
+    factory.url_base = url_base
+    snapshot = {'url_base': url_base, 'retrieved': dt.now().strftime('%Y-%m-%d'), 'biolink_model_version': biolink_version, 'types': {}}
+    for input_type in types:
+        snapshot['types'][input_type] = {'ancestors': factory.get_ancestors(input_type),
+                                         'id_prefixes': factory.get_prefixes(input_type)}
+    with open(fname, 'w') as outf:
+        json.dump(snapshot, outf, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Refresh the local snapshot of the biolink model')
+    parser.add_argument('--refresh-snapshot', action='store_true', help='Pull the compendium types from the biolink model service')
+    parser.add_argument('--types', nargs='+', default=COMPENDIUM_TYPES)
+    parser.add_argument('--biolink-version', help='Version of the biolink model, by default biolink_model_version in config.json')
+    args = parser.parse_args()
+    if args.refresh_snapshot:
+        biolink_version = args.biolink_version
+        if biolink_version is None:
+            from babel.babel_utils import get_config
+            biolink_version = get_config().get('biolink_model_version')
+        refresh_snapshot(args.types, biolink_version=biolink_version)
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+from babel.big_gz_sort import batch_sort
+from babel.block_file import iter_lines
+
+#Wide enough for any line number, so that they sort as text
+LINE_WIDTH = 20
+
+def normalize_file(infname, outfname, compendia, column=0, workdir=None, buffer_size=1000000):
+    """Normalize the curies in one tab separated column of infname against compendia, without holding either
+    in memory.  Each line of infname is written to outfname with the preferred identifier of its curie added
+    as a last column (empty when no compendium has it).  The compendia are tried in order, and the first one
+    that has a curie wins.
+
+    It's a sort-merge join: the (curie, line number) pairs of the input, and an (identifier, preferred
+    identifier) table made from the compendia, are each sorted on disk with big_gz_sort and streamed against
+    each other.  The answers come out in curie order, so they are sorted back into line order and merged with
+    the input as it's copied out.  buffer_size is the number of lines each sort holds in memory at a time.
+    Returns (lines, lines normalized)."""
+    if workdir is None:
+        workdir = os.path.dirname(os.path.abspath(outfname))
+    workdir = tempfile.mkdtemp(prefix='normalize_', dir=workdir)
+    try:
+        curies = _sorted(workdir, 'curies', _input_curies(infname, column), buffer_size)
+        table = _sorted(workdir, 'table', _identifier_table(compendia), buffer_size)
+        answers = _sorted(workdir, 'answers', _join(curies, table), buffer_size)
+        return _merge_answers(infname, outfname, answers)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _sorted(workdir, name, lines, buffer_size):
+    """Stage lines to a file, sort it, and return the sorted file's name"""
+    staged = os.path.join(workdir, f'{name}.unsorted')
+    with open(staged, 'wb') as outf:
+        outf.writelines(lines)
+    chunkdir = os.path.join(workdir, f'{name}.chunks')
+    os.mkdir(chunkdir)
+    sorted_name = os.path.join(workdir, f'{name}.sorted')
+    with open(staged, 'rb') as inf, open(sorted_name, 'wb') as outf:
+        batch_sort(inf, outf, buffer_size=buffer_size, tempdirs=[chunkdir])
+    os.remove(staged)
+    return sorted_name
+
+def _input_curies(infname, column):
+    #tab sorts before anything in a curie, so these sort by curie
+    with open(infname, 'rb') as inf:
+        for n, line in enumerate(inf):
+            fields = line.rstrip(b'\r\n').split(b'\t')
+            if column < len(fields) and len(fields[column]) > 0:
+                yield b'%s\t%0*d\n' % (fields[column], LINE_WIDTH, n)
+
+def _identifier_table(compendia):
+    for rank, fname in enumerate(compendia):
+        for line in iter_lines(fname):
+            record = json.loads(line)
+            preferred = record['id']['identifier'].encode('utf-8')
+            for ident in record['equivalent_identifiers']:
+                yield b'%s\t%04d\t%s\n' % (ident['identifier'].encode('utf-8'), rank, preferred)
+
+def _split(fname):
+    with open(fname, 'rb') as inf:
+        for line in inf:
+            yield line.rstrip(b'\n').split(b'\t')
+
+def _join(curies, table):
+    """Line number and preferred identifier for each curie that's in the table"""
+    entries = _split(table)
+    entry = next(entries, None)
+    for curie, n in _split(curies):
+        while entry is not None and entry[0] < curie:
+            entry = next(entries, None)
+        #the table is sorted by compendium within an identifier, so the first entry is the one that wins
+        if entry is not None and entry[0] == curie:
+            yield b'%s\t%s\n' % (n, entry[2])
+
+def _merge_answers(infname, outfname, answers):
+    lines = 0
+    normalized = 0
+    answer_lines = _split(answers)
+    answer = next(answer_lines, None)
+    with open(infname, 'rb') as inf, open(outfname, 'wb') as outf:
+        for n, line in enumerate(inf):
+            preferred = b''
+            if answer is not None and int(answer[0]) == n:
+                preferred = answer[1]
+                normalized += 1
+                answer = next(answer_lines, None)
+            outf.write(b'%s\t%s\n' % (line.rstrip(b'\r\n'), preferred))
+            lines += 1
+    return lines, normalized
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add the preferred identifier of a column of curies to a tab separated file')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--compendia', nargs='+', required=True, help='compendium files, tried in order')
+    parser.add_argument('--column', type=int, default=0, help='column of the curies, counting from 0')
+    parser.add_argument('--workdir', help='where to put the sort files, by default next to the output')
+    parser.add_argument('--buffer-size', type=int, default=1000000, help='lines held in memory by each sort')
+    args = parser.parse_args()
+    lines, normalized = normalize_file(args.input, args.output, args.compendia, args.column, args.workdir, args.buffer_size)
+    print(f'Normalized {normalized} of {lines} lines')
@@ -0,0 +1,82 @@
+from functools import lru_cache
+import json
+import os
+
+from babel.block_file import iter_lines
+from babel.id_index import CompendiumIndex, id_index_name
+
+class Normalizer:
+    """Normalizes identifiers against one or more compendia, in process.
+
+    normalize(curie) returns the compendium record of the clique that curie is in, which has the preferred
+    identifier and label ('id'), the equivalent identifiers, and the types, or None if no compendium has it.
+    The compendia are tried in the order given, and the first one that has the curie wins.
+
+    Nothing is opened until it's needed.  Compendia with an identifier index (see id_index) are looked up
+    through it, straight out of the mmapped files.  Compendia without one are read into memory the first time
+    they're searched.  The last cache_size answers are kept, so lookups of hot identifiers don't touch the
+    files at all.  The records are shared with the cache, so don't modify them."""
+    def __init__(self, fnames, cache_size=100000):
+        self.fnames = list(fnames)
+        self.compendia = [None] * len(self.fnames)
+        self._normalize = lru_cache(maxsize=cache_size)(self._find)
+
+    def _compendium(self, i):
+        if self.compendia[i] is None:
+            if os.path.exists(id_index_name(self.fnames[i])):
+                self.compendia[i] = CompendiumIndex(self.fnames[i])
+            else:
+                self.compendia[i] = LoadedCompendium(self.fnames[i])
+        return self.compendia[i]
+
+    def line(self, curie):
+        """The record of curie as its compendium line (bytes, with the newline), or None.  Not cached."""
+        for i in range(len(self.fnames)):
+            lines = self._compendium(i).lines(curie)
+            if len(lines) > 0:
+                return lines[0]
+        return None
+
+    def _find(self, curie):
+        line = self.line(curie)
+        if line is None:
+            return None
+        return json.loads(line)
+
+    def normalize(self, curie):
+        return self._normalize(curie)
+
+    def normalize_many(self, curies):
+        """{curie: record or None} for each of curies"""
+        return {curie: self._normalize(curie) for curie in curies}
+
+    def cache_info(self):
+        return self._normalize.cache_info()
+
+    def close(self):
+        for compendium in self.compendia:
+            if compendium is not None:
+                compendium.close()
+        self.compendia = [None] * len(self.fnames)
+        self._normalize.cache_clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class LoadedCompendium:
+    """A compendium without an identifier index, read into a dict of identifier to record line.  Takes the
+    same calls as id_index.CompendiumIndex."""
+    def __init__(self, fname):
+        self.records = {}
+        for line in iter_lines(fname):
+            for ident in json.loads(line)['equivalent_identifiers']:
+                self.records.setdefault(ident['identifier'], []).append(line)
+
+    def lines(self, identifier):
+        return self.records.get(identifier, [])
+
+    def close(self):
+        self.records = {}
@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from babel.block_file import EXTENSIONS, iter_lines
+
+def _schemas():
+    prefix = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    cliques = pyarrow.schema([('clique', pyarrow.int64()), ('identifier', pyarrow.string()), ('label', pyarrow.string()),
+                              ('size', pyarrow.int32()), ('types', pyarrow.list_(prefix))])
+    identifiers = pyarrow.schema([('clique', pyarrow.int64()), ('identifier', pyarrow.string()), ('prefix', prefix),
+                                  ('label', pyarrow.string())])
+    return cliques, identifiers
+
+def export_names(fname, outdir):
+    name = os.path.basename(fname)
+    for extension in EXTENSIONS.values():
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    if name.endswith('.txt'):
+        name = name[:-len('.txt')]
+    return os.path.join(outdir, f'{name}.cliques.parquet'), os.path.join(outdir, f'{name}.identifiers.parquet')
+
+def write_parquet(fname, outdir, batch_records=100000, compression='zstd'):
+    """Write a compendium (plain or block compressed) as two parquet tables in outdir:
+
+        <name>.cliques.parquet      clique, identifier (preferred), label, size, types
+        <name>.identifiers.parquet  clique, identifier, prefix, label
+
+    with one row per clique and one row per equivalent identifier.  clique is the number of the clique's line
+    in the compendium, which joins the two.  prefix and types are dictionary encoded, since there are only a
+    handful of each.  Needs pyarrow.  Returns the names of the tables."""
+    if pyarrow is None:
+        raise ImportError('Parquet export needs the pyarrow package')
+    os.makedirs(outdir, exist_ok=True)
+    clique_name, identifier_name = export_names(fname, outdir)
+    clique_schema, identifier_schema = _schemas()
+    with pyarrow.parquet.ParquetWriter(f'{clique_name}.tmp', clique_schema, compression=compression) as clique_writer, \
+         pyarrow.parquet.ParquetWriter(f'{identifier_name}.tmp', identifier_schema, compression=compression) as identifier_writer:
+        cliques = _columns(clique_schema)
+        identifiers = _columns(identifier_schema)
+        for n, line in enumerate(iter_lines(fname)):
+            record = json.loads(line)
+            equivalents = record['equivalent_identifiers']
+            cliques['clique'].append(n)
+            cliques['identifier'].append(record['id']['identifier'])
+            cliques['label'].append(record['id'].get('label'))
+            cliques['size'].append(len(equivalents))
+            cliques['types'].append(record['type'])
+            for ident in equivalents:
+                identifiers['clique'].append(n)
+                identifiers['identifier'].append(ident['identifier'])
+                identifiers['prefix'].append(ident['identifier'].split(':', 1)[0])
+                identifiers['label'].append(ident.get('label'))
+            if len(cliques['clique']) >= batch_records:
+                _write_batch(clique_writer, clique_schema, cliques)
+                _write_batch(identifier_writer, identifier_schema, identifiers)
+        _write_batch(clique_writer, clique_schema, cliques)
+        _write_batch(identifier_writer, identifier_schema, identifiers)
+    os.replace(f'{clique_name}.tmp', clique_name)
+    os.replace(f'{identifier_name}.tmp', identifier_name)
+    return clique_name, identifier_name
+
+def _columns(schema):
+    return {name: [] for name in schema.names}
+
+def _write_batch(writer, schema, columns):
+    """Write out the rows collected in columns, and empty it"""
+    if len(columns[schema.names[0]]) == 0:
+        return
+    writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+    for values in columns.values():
+        values.clear()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write compendia as parquet tables')
+    parser.add_argument('compendia', nargs='+')
+    parser.add_argument('--outdir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compendia', 'parquet'))
+    args = parser.parse_args()
+    for fname in args.compendia:
+        for table in write_parquet(fname, args.outdir):
+            print(table)
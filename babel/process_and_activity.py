@@ -1,7 +1,8 @@
 from babel.ubergraph import UberGraph
 #from src.LabeledID import LabeledID
 from src.util import Text
-from babel.babel_utils import write_compendium,glom,get_prefixes,clean_sets
+from babel.babel_utils import write_compendium,glom,get_prefixes,clean_sets,dump_quarantine,max_clique_size,write_metrics
+from babel.concordance import Concordance
 from collections import defaultdict
 
 def build_sets(iri, ignore_list = ['PMID','EC']):
@@ -38,10 +39,11 @@ def build_sets(iri, ignore_list = ['PMID','EC']):
 def load_one(starter,stype):
     sets,labels = build_sets(starter)
     #relabel_entities(sets)
-    dicts = {}
+    dicts = Concordance(max_clique_size=max_clique_size('process_and_activity'))
     glom(dicts, sets,unique_prefixes=['GO'])
-    osets = set([frozenset(x) for x in dicts.values()])
-    write_compendium(osets,f'{stype.split(":")[-1]}.txt',stype,labels=labels)
+    dump_quarantine(dicts,f'{stype.split(":")[-1]}_quarantine.txt')
+    write_metrics(dicts,f'{stype.split(":")[-1]}_glom_metrics.jsonl')
+    write_compendium(dicts.cliques(),f'{stype.split(":")[-1]}.txt',stype,labels=labels)
 
 def load():
     load_one('GO:0003674','biolink:MolecularActivity')
@@ -0,0 +1,50 @@
+import argparse
+import json
+import os
+
+from babel.block_file import iter_lines
+
+def resp_command(*args):
+    """One command in the redis protocol, from byte string arguments"""
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+def write_redis_load(compendia, outdir, id_db=0, node_db=1):
+    """Write redis protocol files that load compendia into redis, one file per database:
+    identifiers.db<id_db>.resp sets every equivalent identifier to its preferred identifier, and
+    nodes.db<node_db>.resp sets every preferred identifier to its node, the compendium line as it is.  Each
+    file starts by selecting its database, so it loads with
+
+        redis-cli --pipe < nodes.db1.resp
+
+    When an identifier is in more than one compendium, the first compendium wins, as with Normalizer.
+    Returns the names of the files."""
+    os.makedirs(outdir, exist_ok=True)
+    id_name = os.path.join(outdir, f'identifiers.db{id_db}.resp')
+    node_name = os.path.join(outdir, f'nodes.db{node_db}.resp')
+    with open(f'{id_name}.tmp', 'wb') as id_file, open(f'{node_name}.tmp', 'wb') as node_file:
+        id_file.write(resp_command(b'SELECT', str(id_db).encode()))
+        node_file.write(resp_command(b'SELECT', str(node_db).encode()))
+        #the last SET of a key is the one that sticks, so go backwards
+        for fname in reversed(compendia):
+            for line in iter_lines(fname):
+                record = json.loads(line)
+                preferred = record['id']['identifier'].encode('utf-8')
+                node_file.write(resp_command(b'SET', preferred, line.rstrip(b'\n')))
+                for ident in record['equivalent_identifiers']:
+                    id_file.write(resp_command(b'SET', ident['identifier'].encode('utf-8'), preferred))
+    os.replace(f'{id_name}.tmp', id_name)
+    os.replace(f'{node_name}.tmp', node_name)
+    return id_name, node_name
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write redis mass insert files for compendia')
+    parser.add_argument('compendia', nargs='+', help='compendium files, with the one that wins conflicts first')
+    parser.add_argument('--outdir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compendia', 'redis'))
+    parser.add_argument('--id-db', type=int, default=0, help='database for identifier to preferred identifier')
+    parser.add_argument('--node-db', type=int, default=1, help='database for preferred identifier to node')
+    args = parser.parse_args()
+    for fname in write_redis_load(args.compendia, args.outdir, args.id_db, args.node_db):
+        print(fname)
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+from functools import lru_cache
+import json
+import os
+import signal
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from babel.block_file import index_name
+from babel.id_index import id_index_name
+from babel.normalizer import Normalizer
+
+class NormalizationServer:
+    """A small HTTP service that normalizes curies against compendia, in the shape of the NodeNormalization
+    get_normalized_nodes call:
+
+        GET  /get_normalized_nodes?curie=MESH:D014867&curie=...
+        POST /get_normalized_nodes   {"curies": ["MESH:D014867", ...]}
+
+    both answer {curie: record or null}, where the record is the curie's compendium line as it is.  GET
+    /status says what is loaded.
+
+    Lookups go through a Normalizer, so compendia with identifier indexes are read straight out of the mmapped
+    files, and the last cache_size answers are kept already encoded.  Every reload_interval seconds the
+    compendia and their sidecars are checked, and if a new build has landed, and has stopped changing, a new
+    Normalizer is swapped in for it.  SIGHUP swaps one in right away.  The compendium writers rename finished
+    files into place, so requests against the old build are unaffected until the swap."""
+    def __init__(self, fnames, cache_size=100000, reload_interval=60):
+        self.fnames = list(fnames)
+        self.cache_size = cache_size
+        self.reload_interval = reload_interval
+        self.normalizer = None
+        self.loaded = None
+        self.signature = None
+        self._pending = None
+        self.load()
+
+    def _signature(self):
+        stats = []
+        for fname in self.fnames:
+            for name in [fname, id_index_name(fname), index_name(fname)]:
+                if os.path.exists(name):
+                    stat = os.stat(name)
+                    stats.append((name, stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return stats
+
+    def load(self):
+        """Swap in a Normalizer over the compendia as they are now"""
+        old = self.normalizer
+        self.signature = self._signature()
+        self.normalizer = Normalizer(self.fnames, cache_size=0)
+        self._line = lru_cache(maxsize=self.cache_size)(self.normalizer.line)
+        self.loaded = time.time()
+        if old is not None:
+            old.close()
+
+    def check_reload(self):
+        """Reload if the compendia changed, but only once they look the same two checks in a row, so that we
+        don't pick up a build that's halfway through renaming its files.  Returns True if it reloaded."""
+        signature = self._signature()
+        if signature == self.signature:
+            self._pending = None
+            return False
+        if signature != self._pending:
+            self._pending = signature
+            return False
+        self._pending = None
+        self.load()
+        return True
+
+    def normalized(self, curies):
+        """The response body for a list of curies"""
+        parts = []
+        for curie in curies:
+            line = self._line(curie)
+            parts.append(json.dumps(curie, ensure_ascii=False).encode('utf-8') + b': ' + (b'null' if line is None else line.rstrip(b'\n')))
+        return b'{' + b', '.join(parts) + b'}'
+
+    def respond(self, method, target, body):
+        """(status, response body) for a request"""
+        url = urlsplit(target)
+        if url.path == '/get_normalized_nodes':
+            if method == 'GET':
+                return 200, self.normalized(parse_qs(url.query).get('curie', []))
+            if method == 'POST':
+                try:
+                    curies = json.loads(body)['curies']
+                except (ValueError, KeyError, TypeError):
+                    return 400, json.dumps({'error': 'expected a json object with a list of curies'}).encode()
+                if not isinstance(curies, list) or not all([isinstance(curie, str) for curie in curies]):
+                    return 400, json.dumps({'error': 'curies has to be a list of strings'}).encode()
+                return 200, self.normalized(curies)
+            return 405, json.dumps({'error': f'{method} not allowed'}).encode()
+        if url.path == '/status' and method == 'GET':
+            cache = self._line.cache_info()
+            return 200, json.dumps({'compendia': self.fnames, 'loaded': self.loaded,
+                                    'cache_hits': cache.hits, 'cache_misses': cache.misses}).encode()
+        return 404, json.dumps({'error': f'no such path {url.path}'}).encode()
+
+    async def handle(self, reader, writer):
+        """Serve requests from one connection, keeping it open unless the client says not to"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._send(writer, 400, b'{"error": "bad request line"}', False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = b''
+                if 'content-length' in headers:
+                    body = await reader.readexactly(int(headers['content-length']))
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                try:
+                    status, payload = self.respond(method, target, body)
+                except Exception as e:
+                    #one bad lookup shouldn't take the connection down without an answer
+                    status, payload = 500, json.dumps({'error': f'{type(e).__name__}: {e}'}).encode()
+                await self._send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, payload, keep_alive):
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                   500: 'Internal Server Error'}
+        head = (f'HTTP/1.1 {status} {reasons[status]}\r\nContent-Type: application/json\r\n'
+                f'Content-Length: {len(payload)}\r\nConnection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            self.check_reload()
+
+    async def serve(self, host='0.0.0.0', port=8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.load)
+        except (NotImplementedError, AttributeError):
+            #no SIGHUP on windows
+            pass
+        watcher = asyncio.create_task(self.watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve normalization from compendium files')
+    parser.add_argument('compendia', nargs='+', help='compendium files, tried in order')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-size', type=int, default=100000)
+    parser.add_argument('--reload-interval', type=float, default=60, help='seconds between checks for a new build')
+    args = parser.parse_args()
+    server = NormalizationServer(args.compendia, cache_size=args.cache_size, reload_interval=args.reload_interval)
+    asyncio.run(server.serve(args.host, args.port))
@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import sqlite3
+
+from babel.block_file import iter_lines
+
+TABLES = ['CREATE TABLE cliques (clique INTEGER PRIMARY KEY, identifier TEXT NOT NULL, label TEXT, node TEXT NOT NULL)',
+          'CREATE TABLE identifiers (identifier TEXT NOT NULL, clique INTEGER NOT NULL, label TEXT)']
+#Made after the load, which is a lot faster than keeping them up to date row by row.  The identifier and label
+#indexes carry the clique, so looking either one up never has to touch the table.
+INDEXES = ['CREATE INDEX identifiers_by_identifier ON identifiers (identifier, clique)',
+           'CREATE INDEX identifiers_by_label ON identifiers (label, clique)',
+           'CREATE INDEX cliques_by_identifier ON cliques (identifier)']
+
+def sqlite_name(fname):
+    return f'{fname}.sqlite'
+
+def load_sqlite(fname, dbname=None, batch_records=100000):
+    """Load a compendium (plain or block compressed) into a new SQLite database, by default fname.sqlite.
+    cliques has a row for each clique, with its preferred identifier, label, and the node as it is in the
+    compendium, and identifiers has a row for each equivalent identifier with its clique and label.
+
+    Rows go in with executemany, batch_records cliques to a transaction, with syncing off and no indexes,
+    which are built at the end.  The database is built under a temporary name and renamed into place when
+    it's done, and is left in WAL mode for readers.  Returns the name of the database."""
+    if dbname is None:
+        dbname = sqlite_name(fname)
+    tmpname = f'{dbname}.tmp'
+    for name in [tmpname, f'{tmpname}-wal', f'{tmpname}-shm']:
+        if os.path.exists(name):
+            os.remove(name)
+    connection = sqlite3.connect(tmpname)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=OFF')
+    connection.execute('PRAGMA cache_size=-1000000')
+    for table in TABLES:
+        connection.execute(table)
+    cliques = []
+    identifiers = []
+    for n, line in enumerate(iter_lines(fname)):
+        record = json.loads(line)
+        cliques.append((n, record['id']['identifier'], record['id'].get('label'), line.rstrip(b'\n').decode('utf-8')))
+        for ident in record['equivalent_identifiers']:
+            identifiers.append((ident['identifier'], n, ident.get('label')))
+        if len(cliques) >= batch_records:
+            _insert(connection, cliques, identifiers)
+    _insert(connection, cliques, identifiers)
+    for index in INDEXES:
+        connection.execute(index)
+    connection.execute('ANALYZE')
+    connection.commit()
+    connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    connection.close()
+    os.replace(tmpname, dbname)
+    return dbname
+
+def _insert(connection, cliques, identifiers):
+    with connection:
+        connection.executemany('INSERT INTO cliques VALUES (?,?,?,?)', cliques)
+        connection.executemany('INSERT INTO identifiers VALUES (?,?,?)', identifiers)
+    cliques.clear()
+    identifiers.clear()
+
+class CompendiumDB:
+    """Lookups in a database written by load_sqlite"""
+    def __init__(self, dbname):
+        self.connection = sqlite3.connect(f'file:{dbname}?mode=ro', uri=True)
+
+    def find(self, identifier):
+        """The node (as a dict) of the clique that identifier is in, or None"""
+        curr = self.connection.cursor()
+        curr.execute('SELECT node FROM cliques WHERE clique = (SELECT clique FROM identifiers WHERE identifier=?)', (identifier,))
+        result = curr.fetchone()
+        if result is not None:
+            return json.loads(result[0])
+        return None
+
+    def find_label(self, label):
+        """[(identifier, preferred identifier)] for every identifier with this label"""
+        curr = self.connection.cursor()
+        curr.execute('SELECT i.identifier, c.identifier FROM identifiers i JOIN cliques c ON c.clique = i.clique WHERE i.label=?', (label,))
+        return curr.fetchall()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load compendia into SQLite databases next to them')
+    parser.add_argument('compendia', nargs='+')
+    args = parser.parse_args()
+    for fname in args.compendia:
+        print(load_sqlite(fname))
@@ -3,7 +3,8 @@ import logging
 
 from src.LabeledID import LabeledID
 from src.util import LoggingUtil
-from babel.babel_utils import pull_via_ftp,write_compendium,glom
+from babel.babel_utils import pull_via_ftp,write_compendium,glom,dump_quarantine,max_clique_size,write_metrics
+from babel.concordance import Concordance
 from babel.taxon_mesh import go_mesh
 
 logger = LoggingUtil.init_logging(__name__, level=logging.ERROR)
@@ -33,10 +34,13 @@ def load_taxa():
     labels = {}
     labels.update(ncbi_taxa_labels)
     labels.update(mesh_labels)
-    taxa = {x:[x] for x in ncbi_taxa_labels}
+    taxa = Concordance(max_clique_size=max_clique_size('taxons'))
+    for x in ncbi_taxa_labels:
+        taxa.add(x)
     glom(taxa,meshes)
-    synset = set([frozenset(x) for x in taxa.values()])
-    write_compendium(synset,'taxon_compendium.txt','biolink:OrganismTaxon',labels=labels)
+    dump_quarantine(taxa,'taxon_quarantine.txt')
+    write_metrics(taxa,'taxon_glom_metrics.jsonl')
+    write_compendium(taxa.cliques(),'taxon_compendium.txt','biolink:OrganismTaxon',labels=labels)
 
 if __name__ == '__main__':
     load_taxa()
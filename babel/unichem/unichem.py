@@ -8,20 +8,24 @@ import pandas
 from src.util import LoggingUtil
 from babel.babel_utils import make_local_name,pull_via_urllib
 from babel.big_gz_sort import batch_sort
+from babel.concordance import Concordance
 
 logger = LoggingUtil.init_logging("chemicals", logging.DEBUG, format='medium')
 
-def load_unichem(working_dir: str = '', xref_file: str = None, struct_file: str = None, refresh=False) -> dict:
+def load_unichem(working_dir: str = '', xref_file: str = None, struct_file: str = None, refresh=False) -> Concordance:
     if not refresh:
         upname = make_local_name('unichem.pickle')
         with open(upname,'rb') as up:
             synonyms=pickle.load(up)
+        #Older pickles hold the dict of sets
+        if isinstance(synonyms,dict):
+            synonyms = Concordance.from_dict(synonyms)
         return synonyms
     else:
         return refresh_unichem(working_dir,xref_file,struct_file)
 
 
-def refresh_unichem(working_dir: str = '', xref_file: str = None, struct_file: str = None) -> dict:
+def refresh_unichem(working_dir: str = '', xref_file: str = None, struct_file: str = None) -> Concordance:
     logger.info(f'Start of Unichem loading. Working directory: {working_dir}')
 
     # declare the unichem ids for the target data
@@ -102,11 +106,19 @@ def get_inchi(uci, struct_file):
 def merge_xref_with_structure(filtered_xref_file,struct_file):
     """Given an xref file which is already filtered to structures of interest, and is sorted by uci_key and a
     structure file from which we can pull inchikeys, and which is also sorted by uci_key, create a list of
-    synonymous chemicals by walking through the two files in parallel."""
+    synonymous chemicals by walking through the two files in parallel.
+    The synonyms are returned as a Concordance, so that the curies are interned as we go rather than
+    held as tens of millions of strings pointing at sets.  The groups are glommed with INCHIKEY unique, so
+    a curie that UniChem lists under two structures doesn't fuse their cliques, and the later structure keeps
+    the rest of its curies (see Concordance.glom_structures)."""
+    synonyms = Concordance()
+    synonyms.glom_structures(unichem_groups(filtered_xref_file,struct_file), unique_prefixes=['INCHIKEY'])
+    return synonyms
+
+def unichem_groups(filtered_xref_file,struct_file):
+    """The curies of each structure, along with its INCHIKEY, from the files merge_xref_with_structure reads"""
     #Used to construct curies.  It's repeated from load_unichem which is a bad smell.
     data_sources: dict = {1: 'CHEMBL.COMPOUND', 2: 'DRUGBANK', 4: 'gtpo', 6: 'KEGG', 7: 'CHEBI', 14: 'UNII', 18: 'HMDB', 22: 'PUBCHEM.COMPOUND'}
-    #initialize
-    synonyms: dict = {}
     chem_counter = 0
     with open(filtered_xref_file,'r') as xrefs, open(struct_file,'r') as structs:
         xrefline = xrefs.readline().strip()
@@ -115,17 +127,26 @@ def merge_xref_with_structure(filtered_xref_file,struct_file):
             inchi = get_inchi(uci,structs)
             syn_list = [f'{data_sources[t[1]]}:{t[2]}' for t in nextgroup]
             syn_list.append(f'INCHIKEY:{inchi}')
-            # create a dict of all the curies. each element gets equated with the whole list
-            syn_dict: dict = dict.fromkeys(syn_list, set(syn_list))
-            # add it to the returned list
-            synonyms.update(syn_dict)
+            yield syn_list
             # increment the counter
             chem_counter += 1
             # output some feedback for the user
             if (chem_counter % 250000) == 0:
                 logger.info(f'Processed {chem_counter} unichem chemicals...')
                 print(f'Processed {chem_counter} unichem chemicals...')
-    return synonyms
+
+
+def iter_unichem_pairs(filtered_xref_file,struct_file):
+    """Walk the same sorted files as merge_xref_with_structure, but instead of building the synonyms in memory,
+    stream out an (INCHIKEY, curie) pair for every xref, for out-of-core builders."""
+    data_sources: dict = {1: 'CHEMBL.COMPOUND', 2: 'DRUGBANK', 4: 'gtpo', 6: 'KEGG', 7: 'CHEBI', 14: 'UNII', 18: 'HMDB', 22: 'PUBCHEM.COMPOUND'}
+    with open(filtered_xref_file,'r') as xrefs, open(struct_file,'r') as structs:
+        xrefline = xrefs.readline().strip()
+        while xrefline != '':
+            nextgroup,uci,xrefline = advance_xrefs(xrefline,xrefs)
+            inchikey = f'INCHIKEY:{get_inchi(uci,structs)}'
+            for t in nextgroup:
+                yield (inchikey, f'{data_sources[t[1]]}:{t[2]}')
 
 
 #Here's the original, very slow, implementation.  I can't see any reason to think another approach
@@ -0,0 +1,46 @@
+import random
+import pytest
+from babel.babel_utils import write_compendium_parallel
+from babel.node import NodeFactory, NormalizationPlan
+
+@pytest.fixture
+def cliques():
+    """The cliques of a concordance (or an old-style dict of sets) as a set of frozensets, so that two built
+    different ways can be compared"""
+    def cliques(d):
+        return set([frozenset(x) for x in d.values()])
+    return cliques
+
+@pytest.fixture
+def random_ids():
+    """Seed random, and make n identifiers with prefixes picked from prefixes"""
+    def random_ids(seed, prefixes, n):
+        random.seed(seed)
+        return [f'{random.choice(prefixes)}:{i}' for i in range(n)]
+    return random_ids
+
+@pytest.fixture
+def random_groups():
+    """count groups of size identifiers sampled from ids, using the seed random_ids set"""
+    def random_groups(ids, count, size=2):
+        return [tuple(random.sample(ids,size)) for i in range(count)]
+    return random_groups
+
+@pytest.fixture
+def node_factory():
+    """A NodeFactory with plans for the types the tests write, so that nothing asks the biolink model service"""
+    factory = NodeFactory(snapshot=None)
+    for node_type in ['biolink:ChemicalSubstance', 'biolink:PhenotypicFeature']:
+        factory.plans[node_type] = NormalizationPlan(node_type,['biolink:NamedThing'],['CHEBI','MESH','HP'])
+    return factory
+
+@pytest.fixture
+def write_cliques(node_factory):
+    """Write cliques as a compendium with write_compendium_parallel on two processes.  Returns the file name."""
+    def write(fname, cliques, labels={}, node_type='biolink:ChemicalSubstance', batch_size=5, compression=None,
+              block_records=10000, id_index=False, shards=1):
+        fname = str(fname)
+        write_compendium_parallel(cliques,fname,node_type,labels,node_factory,2,batch_size,compression=compression,
+                                  block_records=block_records,id_index=id_index,shards=shards)
+        return fname
+    return write
@@ -0,0 +1,94 @@
+import gzip
+import os
+import pytest
+from babel.block_file import BlockWriter, LineWriter, ShardedWriter, read_block, read_index, read_manifest, shard_names, shard_of
+from babel.id_index import IdIndexWriter, id_index_name
+
+def write_lines(fname, compression, n, block_records):
+    lines = [([f'X:{i}', f'Y:{i}'], f'{{"id": "X:{i}", "name": "é{i}"}}\n'.encode('utf-8')) for i in range(n)]
+    with BlockWriter(fname, compression, block_records) as outf:
+        for identifier, line in lines:
+            outf.write(identifier, line)
+    return lines
+
+def test_gzip_blocks(tmp_path):
+    """The blocks read back one at a time, and the whole file is still a gzip file"""
+    fname = str(tmp_path / 'out.txt.gz')
+    lines = write_lines(fname, 'gzip', 25, 10)
+    index = read_index(fname)
+    assert [b[2:] for b in index['blocks']] == [[10, 'X:0', 'X:9'], [10, 'X:10', 'X:19'], [5, 'X:20', 'X:24']]
+    assert read_block(fname, index, 1) == [line for _, line in lines[10:20]]
+    with gzip.open(fname, 'rb') as inf:
+        assert inf.read() == b''.join([line for _, line in lines])
+
+def test_zstd_blocks(tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    fname = str(tmp_path / 'out.txt.zst')
+    lines = write_lines(fname, 'zstd', 25, 10)
+    index = read_index(fname)
+    assert len(index['blocks']) == 3
+    assert read_block(fname, index, 2) == [line for _, line in lines[20:]]
+
+def test_bad_compression(tmp_path):
+    with pytest.raises(ValueError):
+        BlockWriter(str(tmp_path / 'out.txt.xz'), 'xz')
+
+def test_sharded_lines(tmp_path):
+    fname = str(tmp_path / 'out.txt')
+    names = shard_names(fname, 2)
+    assert [os.path.basename(name) for name in names] == ['out.000-of-002.txt', 'out.001-of-002.txt']
+    with ShardedWriter(fname, [LineWriter(name) for name in names]) as outf:
+        for i in range(20):
+            outf.write([f'X:{i}'], f'{i}\n'.encode())
+    manifest = read_manifest(fname)
+    assert sum([entry['records'] for entry in manifest['files']]) == 20
+    for shard, name in enumerate(names):
+        with open(name, 'rb') as inf:
+            assert [shard_of(f'X:{int(line)}', 2) for line in inf] == [shard] * manifest['files'][shard]['records']
+
+def test_publish_order(tmp_path, monkeypatch):
+    """Every sidecar is complete and renamed into place before the compendium itself is"""
+    fname = str(tmp_path / 'out.txt.gz')
+    replaced = []
+    real_replace = os.replace
+    def replace(src, dst):
+        #everything is written before anything is renamed
+        assert not os.path.exists(f'{fname}.ids.unsorted')
+        replaced.append(os.path.basename(dst))
+        real_replace(src, dst)
+    monkeypatch.setattr(os, 'replace', replace)
+    with BlockWriter(fname, 'gzip', 3, IdIndexWriter(id_index_name(fname))) as outf:
+        for i in range(10):
+            outf.write([f'X:{i}'], f'{i}\n'.encode())
+    assert replaced == ['out.txt.gz.ids', 'out.txt.gz.index.json', 'out.txt.gz']
+
+def contents(directory):
+    files = {}
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name), 'rb') as inf:
+            files[name] = inf.read()
+    return files
+
+def test_abort(tmp_path):
+    """A with block that fails leaves the old files alone, and no temporary files behind"""
+    for compression in [None, 'gzip']:
+        directory = tmp_path / str(compression)
+        directory.mkdir()
+        fname = str(directory / 'out.txt')
+        def open_shards():
+            writers = []
+            for name in shard_names(fname, 2):
+                if compression is None:
+                    writers.append(LineWriter(name, IdIndexWriter(id_index_name(name))))
+                else:
+                    writers.append(BlockWriter(name, compression, 3, IdIndexWriter(id_index_name(name))))
+            return ShardedWriter(fname, writers)
+        with open_shards() as outf:
+            outf.write(['X:1'], b'old\n')
+        before = contents(directory)
+        with pytest.raises(RuntimeError):
+            with open_shards() as outf:
+                for i in range(10):
+                    outf.write([f'X:{i}'], b'new\n')
+                raise RuntimeError('build failed')
+        assert contents(directory) == before
@@ -0,0 +1,71 @@
+import random
+from babel.babel_utils import glom
+from babel.build_log import BuildLog, capture_stage, record_cliques, update_sources
+from babel.bulk_glom import bulk_glom
+from babel.checkpoints import Checkpoints
+from babel.concordance import Concordance
+
+def make_stages(seed):
+    """Three stages of random groups.  The middle one changes with seed, the others don't."""
+    random.seed(1)
+    prefixes = ['MESH','UNII','CHEBI','INCHIKEY']
+    ids = [f'{random.choice(prefixes)}:{i}' for i in range(200)]
+    first = [tuple(random.sample(ids,2)) for i in range(60)]
+    last = [tuple(random.sample(ids,3)) for i in range(40)]
+    random.seed(seed)
+    middle = [tuple(random.sample(ids,2)) for i in range(40)]
+    def stage_one(concord, labels):
+        concord = Concordance()
+        concord.add_group(first[0])
+        glom(concord,first[1:])
+        return concord
+    def stage_two(concord, labels):
+        bulk_glom(concord,middle,unique_prefixes=['INCHIKEY','UNII'])
+        return concord
+    def stage_three(concord, labels):
+        glom(concord,last,unique_prefixes=['INCHIKEY'])
+        return concord
+    return [('one',stage_one), ('two',stage_two), ('three',stage_three)]
+
+def build(stages):
+    concord = None
+    for name, stage in stages:
+        if concord is not None:
+            concord.log.set_stage(name)
+        result = stage(concord, {})
+        if result is not concord:
+            result.log = BuildLog()
+            result.log.set_stage(name)
+            record_cliques(result, result.log)
+        concord = result
+    return concord
+
+def test_update_matches_rebuild(cliques):
+    """Updating one stage of a build should give the same cliques as building from scratch"""
+    concord = build(make_stages(100))
+    for seed in [101, 102]:
+        stages = make_stages(seed)
+        captured = capture_stage(stages[1][1], 'two', concord, {})
+        update_sources(concord, concord.log, captured)
+        assert cliques(concord) == cliques(build(stages))
+        assert len(concord) == len(build(stages))
+
+def test_no_change(cliques):
+    concord = build(make_stages(100))
+    stages = make_stages(100)
+    before = cliques(concord)
+    assert update_sources(concord, concord.log, capture_stage(stages[2][1], 'three', concord, {})) == 0
+    assert cliques(concord) == before
+
+def test_log_checkpoints(tmp_path, cliques):
+    """The log is saved stage by stage with the checkpoints, and comes back whole"""
+    stages = make_stages(100)
+    checkpoints = Checkpoints('test', [name for name,_ in stages], directory=str(tmp_path))
+    concord = build(stages)
+    for name, _ in stages:
+        checkpoints.save(name, concord, {})
+    loaded, _ = checkpoints.load('three')
+    assert loaded.log.sources == concord.log.sources
+    captured = capture_stage(make_stages(101)[1][1], 'two', loaded, {})
+    update_sources(loaded, loaded.log, captured)
+    assert cliques(loaded) == cliques(build(make_stages(101)))
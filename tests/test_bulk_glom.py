@@ -0,0 +1,85 @@
+import random
+import pytest
+from babel.babel_utils import glom
+from babel.bulk_glom import bulk_glom, bulk_glom_ids, intern_pairs, parallel_forest
+from babel.concordance import Concordance
+
+def test_bulk_matches_glom(cliques, random_ids, random_groups):
+    """Bulk loading pairs should give exactly the same cliques as glomming them one at a time, including
+    all the order-dependent unique_prefixes rejections"""
+    ids = random_ids(42, ['MESH','UNII','CHEBI','INCHIKEY'], 300)
+    start = random_groups(ids, 60)
+    pairs = random_groups(ids, 250) + [(ids[0],ids[0])]
+    slow = Concordance()
+    fast = Concordance()
+    glom(slow,start)
+    glom(fast,start)
+    glom(slow,pairs,unique_prefixes=['INCHIKEY','UNII'])
+    bulk_glom(fast,pairs,unique_prefixes=['INCHIKEY','UNII'])
+    assert len(slow) == len(fast)
+    assert cliques(slow) == cliques(fast)
+
+def test_bulk_simple():
+    d = Concordance()
+    bulk_glom(d,[('1','2'), ('2','3'), ('4','5')])
+    bulk_glom(d,[('5','6')])
+    assert d['1'] == d['2'] == d['3'] == {'1','2','3'}
+    assert d['4'] == d['6'] == {'4','5','6'}
+
+def test_bulk_forbidden():
+    d = Concordance()
+    with pytest.raises(ValueError):
+        bulk_glom(d,[('MESH:1','PUBCHEM:2')])
+
+def test_bulk_then_glom(cliques, random_ids, random_groups):
+    """bulk_glom has to leave the prefix summaries of the cliques it builds in a state that glom can use"""
+    ids = random_ids(3, [f'P{i}' for i in range(70)] + ['INCHIKEY'], 300)
+    pairs = random_groups(ids, 200)
+    more = random_groups(ids, 200)
+    unique = ['INCHIKEY','P1','P65']
+    slow = Concordance()
+    fast = Concordance()
+    glom(slow,pairs,unique_prefixes=unique)
+    bulk_glom(fast,pairs,unique_prefixes=unique)
+    glom(slow,more,unique_prefixes=unique)
+    glom(fast,more,unique_prefixes=unique)
+    assert cliques(slow) == cliques(fast)
+
+def test_bulk_close(cliques, random_groups):
+    random.seed(5)
+    mondos = [f'MONDO:{i}' for i in range(30)]
+    others = [f'UMLS:{i}' for i in range(100)]
+    close = {m: set(random.sample(others,4)) for m in mondos}
+    start = [(m,random.choice(others)) for m in mondos]
+    pairs = random_groups(mondos+others, 150)
+    slow = Concordance()
+    fast = Concordance()
+    glom(slow,start,unique_prefixes=['MONDO'])
+    glom(fast,start,unique_prefixes=['MONDO'])
+    glom(slow,pairs,unique_prefixes=['MONDO'],close={'MONDO':close})
+    bulk_glom(fast,pairs,unique_prefixes=['MONDO'],close={'MONDO':close})
+    assert cliques(slow) == cliques(fast)
+
+def test_parallel_matches_glom(cliques, random_ids, random_groups):
+    """Finding the components from shard forests built on a process pool gives the same cliques"""
+    ids = random_ids(9, ['MESH','UNII','CHEBI','INCHIKEY'], 300)
+    pairs = random_groups(ids, 250)
+    slow = Concordance()
+    fast = Concordance()
+    glom(slow,pairs,unique_prefixes=['INCHIKEY','UNII'])
+    left, right = intern_pairs(fast,pairs)
+    links = parallel_forest(left,right,2,shard_size=40)
+    assert len(links[0]) < 2 * len(left)
+    bulk_glom_ids(fast,left,right,unique_prefixes=['INCHIKEY','UNII'],links=links)
+    assert cliques(slow) == cliques(fast)
+
+def test_bulk_max_clique_size(cliques, random_ids, random_groups):
+    ids = random_ids(13, ['MESH'], 300)
+    pairs = random_groups(ids, 200)
+    slow = Concordance(max_clique_size=6)
+    fast = Concordance(max_clique_size=6)
+    glom(slow,pairs)
+    bulk_glom(fast,pairs)
+    assert cliques(slow) == cliques(fast)
+    assert slow.quarantine == fast.quarantine
+    assert max([len(c) for c in cliques(fast)]) == 6
@@ -0,0 +1,35 @@
+import pytest
+from babel.babel_utils import glom
+from babel.checkpoints import Checkpoints
+from babel.concordance import Concordance
+
+def test_save_load(tmp_path, cliques):
+    """A saved and reloaded concordance should have the same cliques, and keep glomming the same way"""
+    c = Concordance()
+    glom(c,[('MESH:1','UNII:1'), ('UNII:1','CHEBI:1'), ('MESH:2','INCHIKEY:2'), ('nocolon',)])
+    fname = str(tmp_path / 'c.conc')
+    c.save(fname)
+    d = Concordance.load(fname)
+    assert len(d) == len(c)
+    assert cliques(d) == cliques(c)
+    assert d['CHEBI:1'] == {'MESH:1','UNII:1','CHEBI:1'}
+    more = [('MESH:1','INCHIKEY:3'), ('CHEBI:1','MESH:2'), ('MESH:4','CHEBI:4')]
+    glom(c,more)
+    glom(d,more)
+    assert cliques(d) == cliques(c)
+
+def test_resume(tmp_path):
+    stages = ['one','two','three']
+    checkpoints = Checkpoints('test', stages, directory=str(tmp_path))
+    assert checkpoints.resume(None) == (None, {})
+    assert checkpoints.resume('one') == (None, {})
+    c = Concordance()
+    glom(c,[('A:1','B:1')])
+    checkpoints.save('one', c, {'A:1':'a label'})
+    concord, labels = checkpoints.resume('two')
+    assert concord['A:1'] == {'A:1','B:1'}
+    assert labels == {'A:1':'a label'}
+    assert not checkpoints.should_run('one','two')
+    assert checkpoints.should_run('three','two')
+    with pytest.raises(ValueError):
+        checkpoints.resume('four')
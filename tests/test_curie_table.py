@@ -0,0 +1,24 @@
+import pytest
+from babel.curie_table import CurieTable
+
+def test_round_trip():
+    """Interning the same curie twice gives the same id, and we can get the curie back"""
+    table = CurieTable()
+    curies = ['PUBCHEM.COMPOUND:12345','INCHIKEY:BSYNRYMUTXBXSQ-UHFFFAOYSA-N','CHEBI:15377','noprefix','MESH:D014867']
+    ids = [table.intern(c) for c in curies]
+    assert len(set(ids)) == len(curies)
+    assert [table.intern(c) for c in curies] == ids
+    assert [table.curie(i) for i in ids] == curies
+    assert table.prefix(ids[0]) == 'PUBCHEM.COMPOUND'
+    assert table.prefix(ids[3]) is None
+    assert table.get_id('CHEBI:1') is None
+
+def test_grow():
+    """Make sure that nothing gets lost when the hash table is resized"""
+    table = CurieTable()
+    for i in range(10000):
+        assert table.intern(f'CHEBI:{i}') == i
+    assert len(table) == 10000
+    assert table.get_id('CHEBI:9999') == 9999
+    assert table.curie(1234) == 'CHEBI:1234'
+    assert len(table.prefixes) == 1
@@ -0,0 +1,34 @@
+import pytest
+from babel.external_components import ExternalComponents
+
+def test_components(tmp_path):
+    """Make sure we get the same components as we would in memory, even when the memory limit forces
+    everything into lots of partitions"""
+    (tmp_path/'work').mkdir()
+    (tmp_path/'work'/'keep.txt').write_text('not ours')
+    builder = ExternalComponents(workdir=str(tmp_path/'work'), memory_limit=100)
+    builder.add_pairs([('A:1','B:1'),('B:1','C:1'),('D:1','E:1'),('C:1','F:9'),('F:9','G:0')])
+    builder.add_pair('H:1','E:1')
+    builder.add_singleton('Z:1')
+    cliques = set([frozenset(x) for x in builder.cliques()])
+    assert builder.npartitions > 1
+    assert cliques == {frozenset({'A:1','B:1','C:1','F:9','G:0'}), frozenset({'D:1','E:1','H:1'}), frozenset({'Z:1'})}
+    #only our own working directory goes, not the one we were given
+    assert [p.name for p in (tmp_path/'work').iterdir()] == ['keep.txt']
+
+def test_long_chain(tmp_path):
+    builder = ExternalComponents(workdir=str(tmp_path/'work'), memory_limit=1000)
+    builder.add_pairs([(f'X:{i}', f'X:{i+1}') for i in range(50)])
+    cliques = list(builder.cliques())
+    assert len(cliques) == 1
+    assert len(cliques[0]) == 51
+
+def test_shared_workdir(tmp_path):
+    """Two builders with the same workdir don't see each other's pairs"""
+    a = ExternalComponents(workdir=str(tmp_path), memory_limit=1000)
+    b = ExternalComponents(workdir=str(tmp_path), memory_limit=1000)
+    a.add_pair('A:1','B:1')
+    b.add_pair('C:1','D:1')
+    assert [set(x) for x in a.cliques()] == [{'A:1','B:1'}]
+    assert [set(x) for x in b.cliques()] == [{'C:1','D:1'}]
+    assert list(tmp_path.iterdir()) == []
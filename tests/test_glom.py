@@ -1,5 +1,7 @@
+import random
 import pytest
 from babel.babel_utils import glom
+from babel.concordance import Concordance
 from src.LabeledID import LabeledID
 
 """glom is a tool that looks at list of sets of values and combines them together if they share members"""
@@ -46,3 +48,117 @@ def test_bigger_sets():
     assert d['1']==d['2']==d['3']==d['4']==d['5']==d['6']==d['7']=={'1','2','3','4','5','6','7'}
 
 
+def test_concordance_two_calls():
+    """A Concordance should give the same answers as the dict when used with glom"""
+    d = Concordance()
+    eqs = [('1','2'), ('2','3'), ('4','5'), ('6','7')]
+    oeqs = [('5','7')]
+    glom(d,eqs)
+    glom(d,oeqs)
+    assert len(d) == 7
+    assert d['1']==d['2']==d['3']=={'1','2','3'}
+    assert d['4']==d['5']==d['6']==d['7']=={'4','5','6','7'}
+    assert set([frozenset(x) for x in d.values()]) == {frozenset({'1','2','3'}),frozenset({'4','5','6','7'})}
+
+def test_unique_prefixes():
+    """Don't merge two sets that would end up with two identifiers from a unique prefix"""
+    for d in [{}, Concordance()]:
+        eqs = [('MONDO:1','HP:1'), ('MONDO:2','HP:2'), ('HP:1','UMLS:1')]
+        glom(d,eqs,unique_prefixes=['MONDO'])
+        glom(d,[('HP:1','HP:2')],unique_prefixes=['MONDO'])
+        assert d['HP:1'] == {'MONDO:1','HP:1','UMLS:1'}
+        assert d['HP:2'] == {'MONDO:2','HP:2'}
+
+def test_close():
+    """Don't let a close match become an exact match"""
+    close = {'MONDO:1': {'UMLS:2'}, 'MONDO:2': set()}
+    for d in [{}, Concordance()]:
+        glom(d,[('MONDO:1','HP:1'),('MONDO:2','HP:2')],unique_prefixes=['MONDO'])
+        glom(d,[('HP:1','UMLS:1'),('UMLS:2','HP:1'),('UMLS:2','HP:2')],unique_prefixes=['MONDO'],close={'MONDO':close})
+        assert d['MONDO:1'] == {'MONDO:1','HP:1','UMLS:1'}
+        assert d['MONDO:2'] == {'MONDO:2','HP:2','UMLS:2'}
+
+def test_many_prefixes(cliques, random_ids, random_groups):
+    """The Concordance keeps a bitset summary of the prefixes in each clique; make sure it gets the same
+    answers as the dict once there are more prefixes than fit in one word"""
+    ids = random_ids(7, [f'P{i}' for i in range(80)] + ['INCHI', 'INCHIKEY'], 400)
+    unique = ['INCHI', 'P7', 'P70']
+    d = {}
+    c = Concordance()
+    for i in range(5):
+        groups = [group for size in [1,2,3] for group in random_groups(ids, 27, size)]
+        glom(d,groups,unique_prefixes=unique)
+        glom(c,groups,unique_prefixes=unique)
+    assert cliques(d) == cliques(c)
+
+def test_close_random(cliques, random_groups):
+    """The Concordance compiles close into an index; it has to reject exactly what the dict version rejects"""
+    random.seed(11)
+    mondos = [f'MONDO:{i}' for i in range(40)]
+    others = [f'UMLS:{i}' for i in range(120)] + [f'HP:{i}' for i in range(60)]
+    close = {m: set(random.sample(others,3)) for m in mondos}
+    close[mondos[0]].add(mondos[1])
+    d = {}
+    c = Concordance()
+    start = [(m,random.choice(others)) for m in mondos]
+    glom(d,start,unique_prefixes=['MONDO'])
+    glom(c,start,unique_prefixes=['MONDO'])
+    for i in range(4):
+        groups = random_groups(mondos+others, 60)
+        glom(d,groups,unique_prefixes=['UMLS'],close={'MONDO':close})
+        glom(c,groups,unique_prefixes=['UMLS'],close={'MONDO':close})
+    assert cliques(d) == cliques(c)
+
+def test_cliques():
+    """cliques() gives each clique once, the same as deduping values()"""
+    d = Concordance()
+    glom(d,[('1','2'), ('2','3'), ('4','5'), ('6',)])
+    cliques = list(d.cliques())
+    assert len(cliques) == 3
+    assert set(cliques) == set([frozenset(x) for x in d.values()])
+
+def test_max_clique_size():
+    """Groups that would make a clique bigger than the ceiling are left out and quarantined"""
+    d = Concordance(max_clique_size=3)
+    glom(d,[('1','2'), ('2','3'), ('3','4'), ('5','6'), ('6','1'), ('1','2','3')])
+    assert d['1'] == {'1','2','3'}
+    assert d['5'] == {'5','6'}
+    assert d.quarantine == [(['3','4'], 4), (['6','1'], 5)]
+
+def test_metrics():
+    """Each glom call leaves a record of what it did"""
+    d = Concordance()
+    d.stage = 'first'
+    glom(d,[('MONDO:1','HP:1'), ('MONDO:2','HP:2'), ('HP:1','UMLS:1')],unique_prefixes=['MONDO'])
+    d.stage = 'second'
+    glom(d,[('HP:1','HP:2'), ('HP:1','UMLS:2')],unique_prefixes=['MONDO'],pref='UMLS')
+    first, second = d.metrics
+    assert first['stage'] == 'first'
+    assert first['groups'] == first['merged'] == 3
+    assert first['rejected'] == {}
+    assert (first['largest_before'], first['largest_after']) == (0, 3)
+    assert second['stage'] == 'second'
+    assert second['pref'] == 'UMLS'
+    assert second['groups'] == 2
+    assert second['merged'] == 1
+    assert second['rejected'] == {'unique_prefixes': 1}
+    assert (second['largest_before'], second['largest_after']) == (3, 4)
+
+def test_from_dict_unique():
+    """Old style dicts whose sets share a member don't get fused past an INCHIKEY"""
+    a = set(['INCHIKEY:A','CHEBI:1','MESH:D1'])
+    b = set(['INCHIKEY:B','CHEBI:1'])
+    c = set(['MESH:D1','UNII:1'])
+    conc = Concordance.from_dict({'INCHIKEY:A': a, 'CHEBI:1': b, 'MESH:D1': a, 'INCHIKEY:B': b, 'UNII:1': c})
+    assert conc['CHEBI:1'] == a | c
+    assert conc['UNII:1'] == a | c
+    assert conc['INCHIKEY:B'] == set(['INCHIKEY:B'])
+
+def test_glom_structures():
+    """A structure that shares a curie with an earlier one keeps the rest of its curies as a clique"""
+    conc = Concordance()
+    conc.glom_structures([['CHEBI:1','CHEMBL.COMPOUND:1','INCHIKEY:A'],
+                          ['CHEBI:1','DRUGBANK:9','PUBCHEM.COMPOUND:7','INCHIKEY:B'],
+                          ['DRUGBANK:9','UNII:2']])
+    assert conc['CHEBI:1'] == set(['CHEBI:1','CHEMBL.COMPOUND:1','INCHIKEY:A'])
+    assert conc['INCHIKEY:B'] == set(['DRUGBANK:9','PUBCHEM.COMPOUND:7','INCHIKEY:B','UNII:2'])
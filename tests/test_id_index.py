@@ -0,0 +1,40 @@
+import random
+from babel.id_index import CompendiumIndex, IdIndex, IdIndexWriter
+
+def test_find(tmp_path, write_cliques):
+    """Every identifier leads back to its clique, in plain and block compressed compendia"""
+    cliques = [[f'CHEBI:{i}',f'MESH:D{i}'] for i in range(50)] + [['MESH:é']]
+    plain = write_cliques(tmp_path / 'plain.txt',cliques,batch_size=7,id_index=True)
+    blocks = write_cliques(tmp_path / 'blocks.txt.gz',cliques,batch_size=7,compression='gzip',block_records=5,id_index=True)
+    for fname in [plain, blocks]:
+        with CompendiumIndex(fname) as index:
+            for clique in cliques:
+                for identifier in clique:
+                    found = index.find(identifier)
+                    assert len(found) == 1
+                    assert set([x['identifier'] for x in found[0]['equivalent_identifiers']]) == set(clique)
+            assert index.find('CHEBI:50') == []
+            assert index.find('CHEBI:1000000000000000000') == []
+
+def test_external_sort(tmp_path):
+    """An index that's sorted in many chunks comes out the same as a dict"""
+    fname = str(tmp_path / 'x.ids')
+    writer = IdIndexWriter(fname, buffer_size=100)
+    expected = {}
+    identifiers = [f'X:{i}' for i in range(2000)]
+    random.shuffle(identifiers)
+    for offset, identifier in enumerate(identifiers):
+        writer.add([identifier], offset * 10, offset % 7)
+        expected[identifier] = (offset * 10, offset % 7)
+    writer.add(['X:5'], 5, 0)
+    writer.close()
+    with IdIndex(fname) as index:
+        assert len(index) == 2001
+        for identifier, position in expected.items():
+            if identifier == 'X:5':
+                assert index.positions(identifier) == sorted([(5, 0), position])
+            else:
+                assert index.positions(identifier) == [position]
+        assert index.positions('X:') == []
+        assert index.positions('Y:1') == []
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['x.ids']
@@ -1,3 +1,4 @@
+import json
 import pytest
 from babel.node import NodeFactory
 from src.LabeledID import LabeledID
@@ -116,3 +117,38 @@ def test_losing_umls():
     assert node['id']['identifier'] == 'HP:0010804'
     assert node['id']['label'] == 'Tented upper lip vermilion'
     assert len(node['equivalent_identifiers']) == 4
+
+def make_snapshot(tmp_path):
+    snapshot = {'url_base': 'test', 'retrieved': '2020-01-01', 'biolink_model_version': '1.4.0', 'types': {
+        'chemical_substance': {'ancestors': ['named_thing','biological_entity','molecular_entity'],
+                               'id_prefixes': ['CHEBI','MESH']}}}
+    fname = str(tmp_path / 'snapshot.json')
+    with open(fname,'w') as outf:
+        json.dump(snapshot,outf)
+    return fname
+
+def test_snapshot(tmp_path):
+    """With a snapshot, the biolink model comes from the file, and the type order is the same every time"""
+    fac = NodeFactory(snapshot=make_snapshot(tmp_path))
+    assert fac.get_prefixes('chemical_substance') == ['CHEBI','MESH']
+    first = fac.create_node(['MESH:D012034','CHEBI:1234'],'chemical_substance')
+    second = fac.create_node(['MESH:D012034','CHEBI:1234'],'chemical_substance')
+    assert first['id']['identifier'] == 'CHEBI:1234'
+    assert first['type'] == second['type'] == ['chemical_substance','molecular_entity','biological_entity','named_thing']
+
+def test_snapshot_version(tmp_path):
+    """A snapshot of a different biolink model version than asked for is refused"""
+    fname = make_snapshot(tmp_path)
+    assert NodeFactory(snapshot=fname,biolink_version='1.4.0').get_prefixes('chemical_substance') == ['CHEBI','MESH']
+    with pytest.raises(ValueError):
+        NodeFactory(snapshot=fname,biolink_version='1.5.0')
+
+def test_plan_ordering(tmp_path):
+    """Identifiers come out in the type's prefix order, in input order within a prefix, with the canonical
+    prefix spelling, and unknown prefixes dropped"""
+    fac = NodeFactory(snapshot=make_snapshot(tmp_path))
+    node = fac.create_node(['mesh:D2','CHEBI:1','FOO:1','Mesh:D1'],'chemical_substance',{'mesh:D2':'two','CHEBI:1':''})
+    assert [x['identifier'] for x in node['equivalent_identifiers']] == ['CHEBI:1','MESH:D2','MESH:D1']
+    assert node['equivalent_identifiers'][1] == {'identifier':'MESH:D2','label':'two'}
+    assert node['id'] == {'identifier':'CHEBI:1','label':'two'}
+    assert fac.create_node(['FOO:1'],'chemical_substance') is None
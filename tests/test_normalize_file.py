@@ -0,0 +1,31 @@
+import random
+from babel.normalize_file import normalize_file
+from babel.normalizer import Normalizer
+
+def test_normalize_file(tmp_path, write_cliques):
+    """The sort-merge join gives the same answers, in the same order, as looking each curie up"""
+    chemicals = write_cliques(tmp_path / 'chemicals.txt.gz',[[f'MESH:D{i}',f'CHEBI:{i}'] for i in range(300)],batch_size=50,
+                              compression='gzip',block_records=40)
+    #MESH:D5 is in both, and the first compendium wins
+    others = write_cliques(tmp_path / 'others.txt',[['MESH:D5','MESH:D1000'],['MESH:D2000']])
+    random.seed(3)
+    rows = []
+    for n in range(2000):
+        curie = random.choice([f'MESH:D{random.randrange(400)}', f'CHEBI:{random.randrange(400)}', 'MESH:D1000', 'MESH:D2000', ''])
+        rows.append(f'row{n}\t{curie}\textra')
+    rows.append('short')
+    infname = tmp_path / 'input.tsv'
+    infname.write_text('\n'.join(rows) + '\n')
+    outfname = str(tmp_path / 'output.tsv')
+    lines, normalized = normalize_file(str(infname), outfname, [chemicals, others], column=1, buffer_size=100)
+    expected = []
+    with Normalizer([chemicals, others]) as normalizer:
+        for row in rows:
+            fields = row.split('\t')
+            record = normalizer.normalize(fields[1]) if len(fields) > 1 and fields[1] else None
+            expected.append(f"{row}\t{record['id']['identifier'] if record else ''}")
+    with open(outfname) as inf:
+        assert inf.read().splitlines() == expected
+    assert lines == len(rows)
+    assert normalized == len([row for row in expected if not row.endswith('\t')])
+    assert sorted(p.name for p in tmp_path.iterdir() if p.name.startswith('normalize_')) == []
@@ -0,0 +1,29 @@
+import os
+from babel.id_index import id_index_name
+from babel.normalizer import Normalizer
+
+def test_normalize(tmp_path, write_cliques):
+    """Indexed, compressed, and unindexed compendia all normalize the same way, and the first compendium
+    with an identifier wins"""
+    chemicals = [[f'MESH:D{i}',f'CHEBI:{i}'] for i in range(10)]
+    labels = {'CHEBI:3': 'three'}
+    for compression, id_index in [(None, True), ('gzip', True), (None, False), ('gzip', False)]:
+        directory = tmp_path / f'{compression}_{id_index}'
+        directory.mkdir()
+        name = 'chemicals.txt' + ('.gz' if compression else '')
+        chem = write_cliques(directory / name,chemicals,labels,batch_size=3,compression=compression,block_records=4,id_index=id_index)
+        assert os.path.exists(id_index_name(chem)) == id_index
+        phenotypes = write_cliques(directory / 'phenotypes.txt',[['HP:1','MESH:D3']],node_type='biolink:PhenotypicFeature',id_index=True)
+        with Normalizer([chem, phenotypes]) as normalizer:
+            record = normalizer.normalize('MESH:D3')
+            assert record['id'] == {'identifier': 'CHEBI:3', 'label': 'three'}
+            assert [x['identifier'] for x in record['equivalent_identifiers']] == ['CHEBI:3','MESH:D3']
+            assert record['type'] == ['biolink:ChemicalSubstance','biolink:NamedThing']
+            assert normalizer.normalize('HP:1')['type'][0] == 'biolink:PhenotypicFeature'
+            assert normalizer.normalize('CHEBI:99') is None
+            many = normalizer.normalize_many(['CHEBI:1','MESH:D1','HP:2'])
+            assert many['CHEBI:1'] == many['MESH:D1']
+            assert many['HP:2'] is None
+            assert normalizer.cache_info().hits == 0
+            normalizer.normalize('MESH:D3')
+            assert normalizer.cache_info().hits == 1
@@ -0,0 +1,22 @@
+import pytest
+from babel.parquet_export import write_parquet
+
+def test_parquet(tmp_path, write_cliques):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    cliques = [[f'MESH:D{i}',f'CHEBI:{i}'] for i in range(5)] + [['MESH:D100']]
+    fname = write_cliques(tmp_path / 'chemicals.txt.gz',cliques,{'MESH:D1': 'one'},compression='gzip',block_records=2)
+    clique_name, identifier_name = write_parquet(fname, str(tmp_path / 'parquet'), batch_records=4)
+    assert clique_name.endswith('chemicals.cliques.parquet')
+    cliques_table = parquet.read_table(clique_name).to_pydict()
+    assert cliques_table['clique'] == list(range(6))
+    assert cliques_table['identifier'] == [f'CHEBI:{i}' for i in range(5)] + ['MESH:D100']
+    assert cliques_table['label'] == [None, 'one', None, None, None, None]
+    assert cliques_table['size'] == [2] * 5 + [1]
+    assert cliques_table['types'][0] == ['biolink:ChemicalSubstance','biolink:NamedThing']
+    identifiers = parquet.read_table(identifier_name)
+    assert str(identifiers.schema.field('prefix').type).startswith('dictionary')
+    identifiers = identifiers.to_pydict()
+    assert len(identifiers['identifier']) == 11
+    assert [x for x, c in zip(identifiers['identifier'], identifiers['clique']) if c == 1] == ['CHEBI:1','MESH:D1']
+    assert identifiers['prefix'][:2] == ['CHEBI','MESH']
+    assert identifiers['label'][3] == 'one'
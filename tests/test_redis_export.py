@@ -0,0 +1,39 @@
+import json
+from babel.redis_export import write_redis_load
+
+def replay(fname, databases):
+    """Run a redis protocol file against dicts standing in for redis databases"""
+    with open(fname, 'rb') as inf:
+        data = inf.read()
+    db = 0
+    pos = 0
+    while pos < len(data):
+        assert data[pos:pos + 1] == b'*'
+        end = data.index(b'\r\n', pos)
+        nargs = int(data[pos + 1:end])
+        pos = end + 2
+        args = []
+        for _ in range(nargs):
+            assert data[pos:pos + 1] == b'$'
+            end = data.index(b'\r\n', pos)
+            length = int(data[pos + 1:end])
+            args.append(data[end + 2:end + 2 + length])
+            assert data[end + 2 + length:end + 4 + length] == b'\r\n'
+            pos = end + 4 + length
+        if args[0] == b'SELECT':
+            db = int(args[1])
+        else:
+            assert args[0] == b'SET' and len(args) == 3
+            databases.setdefault(db, {})[args[1].decode('utf-8')] = args[2].decode('utf-8')
+
+def test_redis_load(tmp_path, write_cliques):
+    chemicals = write_cliques(tmp_path / 'chemicals.txt.gz',[['MESH:D1','CHEBI:1'],['MESH:D2']],{'CHEBI:1': 'é "one"'},
+                              compression='gzip',block_records=1)
+    others = write_cliques(tmp_path / 'others.txt',[['MESH:D1','MESH:D3']])
+    databases = {}
+    for fname in write_redis_load([chemicals, others], str(tmp_path / 'redis')):
+        replay(fname, databases)
+    assert databases[0] == {'MESH:D1': 'CHEBI:1', 'CHEBI:1': 'CHEBI:1', 'MESH:D2': 'MESH:D2', 'MESH:D3': 'MESH:D1'}
+    node = json.loads(databases[1]['CHEBI:1'])
+    assert node['id'] == {'identifier': 'CHEBI:1', 'label': 'é "one"'}
+    assert set(databases[1]) == {'CHEBI:1', 'MESH:D2', 'MESH:D1'}
@@ -0,0 +1,93 @@
+import asyncio
+import json
+from babel.server import NormalizationServer
+
+def test_respond(tmp_path, write_cliques):
+    fname = str(tmp_path / 'chemicals.txt')
+    write_cliques(fname, [['MESH:D1','CHEBI:1'],['MESH:D2']], {'CHEBI:1': 'one'}, batch_size=3, id_index=True)
+    server = NormalizationServer([fname])
+    status, body = server.respond('GET', '/get_normalized_nodes?curie=MESH:D1&curie=FOO:1', b'')
+    assert status == 200
+    result = json.loads(body)
+    assert result['MESH:D1']['id'] == {'identifier': 'CHEBI:1', 'label': 'one'}
+    assert result['FOO:1'] is None
+    status, body = server.respond('POST', '/get_normalized_nodes', json.dumps({'curies': ['MESH:D2','CHEBI:1']}).encode())
+    assert list(json.loads(body)) == ['MESH:D2','CHEBI:1']
+    assert server.respond('POST', '/get_normalized_nodes', b'{"curie": "x"}')[0] == 400
+    assert server.respond('POST', '/get_normalized_nodes', b'{"curies": "MESH:D1"}')[0] == 400
+    assert server.respond('GET', '/nope', b'')[0] == 404
+    server.respond('GET', '/get_normalized_nodes?curie=MESH:D1', b'')
+    status = json.loads(server.respond('GET', '/status', b'')[1])
+    assert (status['cache_hits'], status['cache_misses']) == (1, 4)
+
+def test_reload(tmp_path, write_cliques):
+    """A new build is picked up once it has settled, and lookups see it"""
+    fname = str(tmp_path / 'chemicals.txt')
+    write_cliques(fname, [['MESH:D1','CHEBI:1']], batch_size=3, id_index=True)
+    server = NormalizationServer([fname])
+    assert json.loads(server.normalized(['MESH:D2'])) == {'MESH:D2': None}
+    write_cliques(fname, [['MESH:D2','CHEBI:2']], batch_size=3, id_index=True)
+    #the old build still answers until the swap
+    assert json.loads(server.normalized(['MESH:D1']))['MESH:D1']['id']['identifier'] == 'CHEBI:1'
+    assert not server.check_reload()
+    assert server.check_reload()
+    assert not server.check_reload()
+    assert json.loads(server.normalized(['MESH:D2']))['MESH:D2']['id']['identifier'] == 'CHEBI:2'
+    assert json.loads(server.normalized(['MESH:D1'])) == {'MESH:D1': None}
+
+def test_http(tmp_path, write_cliques):
+    fname = str(tmp_path / 'chemicals.txt')
+    write_cliques(fname, [['MESH:D1','CHEBI:1']], batch_size=3, id_index=True)
+    server = NormalizationServer([fname])
+
+    async def run():
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        body = json.dumps({'curies': ['MESH:D1']}).encode()
+        responses = []
+        #two requests on one connection
+        for connection in ['keep-alive', 'close']:
+            writer.write(f'POST /get_normalized_nodes HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: {connection}\r\n\r\n'.encode() + body)
+            await writer.drain()
+            status = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode().partition(':')
+                headers[name.lower()] = value.strip()
+            responses.append((status, json.loads(await reader.readexactly(int(headers['content-length'])))))
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        return responses
+
+    responses = asyncio.run(run())
+    for status, result in responses:
+        assert status.startswith(b'HTTP/1.1 200')
+        assert result['MESH:D1']['id']['identifier'] == 'CHEBI:1'
+
+def test_error(tmp_path, write_cliques):
+    """A request that fails gets a 500 instead of a dropped connection"""
+    fname = write_cliques(tmp_path / 'chemicals.txt', [['MESH:D1','CHEBI:1']], id_index=True)
+    server = NormalizationServer([fname])
+    def fail(method, target, body):
+        raise KeyError('broken')
+    server.respond = fail
+
+    async def run():
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection('127.0.0.1', listener.sockets[0].getsockname()[1])
+        writer.write(b'GET /status HTTP/1.1\r\nConnection: close\r\n\r\n')
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        return response
+
+    response = asyncio.run(run())
+    assert response.startswith(b'HTTP/1.1 500 Internal Server Error')
+    assert b'KeyError' in response
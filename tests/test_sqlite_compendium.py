@@ -0,0 +1,20 @@
+import sqlite3
+from babel.sqlite_compendium import CompendiumDB, load_sqlite
+
+def test_sqlite(tmp_path, write_cliques):
+    cliques = [[f'MESH:D{i}',f'CHEBI:{i}'] for i in range(20)]
+    labels = {'MESH:D3': 'three', 'CHEBI:4': 'three'}
+    fname = write_cliques(tmp_path / 'chemicals.txt.gz',cliques,labels,compression='gzip',block_records=3)
+    dbname = load_sqlite(fname, batch_records=7)
+    assert dbname == fname + '.sqlite'
+    with CompendiumDB(dbname) as db:
+        node = db.find('MESH:D3')
+        assert node['id'] == {'identifier': 'CHEBI:3', 'label': 'three'}
+        assert db.find('MESH:D99') is None
+        assert sorted(db.find_label('three')) == [('CHEBI:4','CHEBI:4'), ('MESH:D3','CHEBI:3')]
+        assert db.connection.execute('SELECT count(*) FROM identifiers').fetchone()[0] == 40
+        plan = ' '.join([row[-1] for row in db.connection.execute('EXPLAIN QUERY PLAN SELECT clique FROM identifiers WHERE identifier=?', ('MESH:D3',))])
+        assert 'COVERING INDEX identifiers_by_identifier' in plan
+    #loading again replaces the database
+    assert load_sqlite(fname) == dbname
+    assert sqlite3.connect(dbname).execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
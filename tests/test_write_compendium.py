@@ -0,0 +1,91 @@
+import hashlib
+import json
+from io import BytesIO
+import jsonlines
+from babel.block_file import BlockWriter, iter_lines, read_index, read_manifest, shard_of
+from babel.id_index import CompendiumIndex
+from babel.node import NodeEncoder
+
+def test_parallel_matches_serial(tmp_path, node_factory, write_cliques):
+    """The process pool writer has to produce exactly the file that the serial writer does"""
+    cliques = [frozenset([f'CHEBI:{i}',f'MESH:D{i}']) for i in range(100)] + [frozenset(['FOO:1'])]
+    labels = {'CHEBI:3':'water', 'MESH:D5':'naïve "quoted" label'}
+    serial = str(tmp_path / 'serial.txt')
+    with jsonlines.open(serial,'w') as outf:
+        for clique in cliques:
+            node = node_factory.create_node(clique,'biolink:ChemicalSubstance',labels)
+            if node is not None:
+                outf.write(node)
+    parallel = write_cliques(tmp_path / 'parallel.txt',iter(cliques),labels,batch_size=7)
+    with open(serial,'rb') as a, open(parallel,'rb') as b:
+        assert a.read() == b.read()
+
+def test_encoder_matches_jsonlines(node_factory):
+    """NodeEncoder has to give the same bytes as jsonlines, including escapes, non-ascii, and nodes it hands
+    off to the json encoder"""
+    types = ['biolink:ChemicalSubstance','biolink:NamedThing']
+    encoder = NodeEncoder(node_factory.get_plan('biolink:ChemicalSubstance').types)
+    labels = {'CHEBI:1': 'α-tocopherol', 'MESH:D2': 'tab\there "quote" back\\slash \x01', 'CHEBI:3': '  line sep'}
+    nodes = [node_factory.create_node(clique,'biolink:ChemicalSubstance',labels)
+             for clique in [['CHEBI:1'],['MESH:D2','CHEBI:3'],['MESH:D4','MESH:D2'],['CHEBI:1','CHEBI:3','MESH:D2']]]
+    nodes.append({'id': {'identifier': 'X:1'}, 'equivalent_identifiers': [{'identifier': 'X:1'}], 'type': types})
+    nodes.append({'id': {'identifier': 'X:1', 'label': 7}, 'equivalent_identifiers': [{'identifier': 'X:1', 'label': 7}],
+                  'type': node_factory.get_plan('biolink:ChemicalSubstance').types})
+    expected = BytesIO()
+    with jsonlines.Writer(expected) as writer:
+        for node in nodes:
+            writer.write(node)
+    assert b''.join([encoder.encode(node).encode('utf-8') for node in nodes]) == expected.getvalue()
+
+def test_parallel_blocks(tmp_path, node_factory, write_cliques):
+    """Compressed blocks made on the pool are the ones the serial BlockWriter makes"""
+    cliques = [frozenset([f'CHEBI:{i}',f'MESH:D{i}']) for i in range(100)]
+    encoder = NodeEncoder(node_factory.get_plan('biolink:ChemicalSubstance').types)
+    serial = str(tmp_path / 'serial.txt.gz')
+    with BlockWriter(serial,'gzip',7) as outf:
+        for clique in cliques:
+            node = node_factory.create_node(clique,'biolink:ChemicalSubstance',{})
+            outf.write([ident['identifier'] for ident in node['equivalent_identifiers']],encoder.encode(node).encode('utf-8'))
+    parallel = write_cliques(tmp_path / 'parallel.txt.gz',cliques,batch_size=1000,compression='gzip',block_records=7)
+    assert read_index(serial) == read_index(parallel)
+    with open(serial,'rb') as a, open(parallel,'rb') as b:
+        assert a.read() == b.read()
+
+def test_parallel_batch_size(tmp_path, write_cliques):
+    """Compressed, each batch is cut into its own blocks, so a batch_size that isn't a multiple of block_records,
+    or a set that makes no node, leaves short blocks, but the lines are still those of the plain file"""
+    cliques = [[f'CHEBI:{i}',f'MESH:D{i}'] for i in range(30)]
+    cliques.insert(5,['FOO:1'])
+    plain = write_cliques(tmp_path / 'plain.txt',cliques,batch_size=10)
+    blocks = write_cliques(tmp_path / 'blocks.txt.gz',cliques,batch_size=10,compression='gzip',block_records=7)
+    assert [block[2] for block in read_index(blocks)['blocks']] == [7,2,7,3,7,3,1]
+    assert list(iter_lines(blocks)) == list(iter_lines(plain))
+
+def test_parallel_shards(tmp_path, write_cliques):
+    """Sharded output has the same lines as unsharded, each in the shard its preferred identifier hashes to,
+    and a manifest that matches the files"""
+    cliques = [frozenset([f'CHEBI:{i}',f'MESH:D{i}']) for i in range(100)]
+    whole = write_cliques(tmp_path / 'whole.txt',cliques,batch_size=7)
+    with open(whole,'rb') as inf:
+        expected = inf.read().splitlines(keepends=True)
+    for compression in [None, 'gzip']:
+        fname = write_cliques(tmp_path / ('chemicals.txt' + ('.gz' if compression else '')),cliques,batch_size=7,
+                              compression=compression,block_records=5,id_index=True,shards=3)
+        manifest = read_manifest(fname)
+        assert [entry['file'] for entry in manifest['files']] == [f'chemicals.00{i}-of-003.txt' + ('.gz' if compression else '') for i in range(3)]
+        lines = []
+        for shard, entry in enumerate(manifest['files']):
+            shard_lines = list(iter_lines(entry['path']))
+            assert len(shard_lines) == entry['records']
+            with open(entry['path'],'rb') as inf:
+                assert hashlib.sha256(inf.read()).hexdigest() == entry['sha256']
+            for line in shard_lines:
+                assert shard_of(json.loads(line)['id']['identifier'],3) == shard
+            with CompendiumIndex(entry['path']) as index:
+                assert index.lines(json.loads(shard_lines[0])['equivalent_identifiers'][-1]['identifier']) == [shard_lines[0]]
+            lines.extend(shard_lines)
+        #the shards keep the order of the whole file
+        assert sorted(lines, key=expected.index) == expected
+        for shard, entry in enumerate(manifest['files']):
+            shard_lines = list(iter_lines(entry['path']))
+            assert shard_lines == [line for line in expected if line in shard_lines]